@@ -1,7 +1,28 @@
 import streamlit as st
+import atexit
+import io
+import math
 import requests
-from datetime import datetime, date, timedelta
-from typing import Dict, List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, date, timedelta, timezone
+from dateutil import parser as date_parser
+from deadline import Deadline, hedged
+from forecast_areas import AreaIndex
+from jobs import DONE, QUEUED, Job, JobQueue, SessionResults, bind_job, current_job
+from metrics import MetricsRegistry, start_file_exporter, start_http_exporter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from news_index import NewsIndex
+from news_scoring import NgramIdf, score_company_articles, score_industry_articles
+from prefetch import PrefetchScheduler, QuotaBudget, RefreshQueue, RoundRobin
+from ratelimit import RateLimiter, UpstreamUnavailable
+from response_cache import RedisBackend, ResponseCache, SQLiteBackend, VariantPool
+from timezones import JST
+from token_budget import UsageLedger, count_tokens, fit_to_budget, truncate_text
+from typing import Callable, Dict, List, Optional, Tuple
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 ###################
 # 定数の定義
@@ -12,7 +33,7 @@ LOCATIONS = {
     "北海道": ["札幌市", "旭川市", "函館市", "釧路市", "帯広市", "北見市"],
     "東京都": [
         "千代田区", "中央区", "港区", "新宿区", "文京区", "台東区", 
-        "墨田区", "江東区", "品川区", "目黑区", "大田区", "世田谷区",
+        "墨田区", "江東区", "品川区", "目黒区", "大田区", "世田谷区",
         "渋谷区", "中野区", "杉並区", "豊島区", "北区", "荒川区",
         "板橋区", "練馬区", "足立区", "葛飾区", "江戸川区"
     ],
@@ -76,38 +97,546 @@ INDUSTRIES = {
     ]
 }
 
-# 地域コード（天気予報用）
-CITY_CODES = {
-    "札幌市": "016010",
-    "旭川市": "012010",
-    "函館市": "017010",
-    "千代田区": "130010",
-    "中央区": "130010",
-    "港区": "130010",
-    "新宿区": "130010",
-    "渋谷区": "130010",
-    "品川区": "130010",
-    "横浜市": "140010",
-    "川崎市": "140010",
-    "さいたま市": "110010",
-    "千葉市": "120010",
-    "名古屋市": "230010",
-    "大阪市": "270000",
-    "神戸市": "280010",
-    "京都市": "260010",
-    "福岡市": "400010",
-    "北九州市": "401000"
+# 外部APIの接続先
+WEATHER_API_BASE = "https://weather.tsukumijima.net"
+NEWS_API_BASE = "https://newsapi.org"
+# 接続先の上書き（secrets の [endpoints]。ベンチマーク用のスタブなど。openai は None で公式 API）
+ENDPOINT_DEFAULTS = {
+    "weather": WEATHER_API_BASE,
+    "news": NEWS_API_BASE,
+    "openai": None
 }
 
+# HTTP 接続プールの設定（ホストごと）
+HTTP_POOL_MAXSIZE = 10
+HTTP_MAX_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.3
+# 締め切りの指定がない呼び出しのタイムアウトと接続のタイムアウト（秒）
+HTTP_DEFAULT_TIMEOUT = 10.0
+HTTP_CONNECT_TIMEOUT = 3.05
+# OpenAI API のタイムアウト（締め切りの指定がない場合、秒）
+OPENAI_DEFAULT_TIMEOUT = 60.0
+
+# 外部APIの呼び出し回数の制限とサーキットブレーカー（secrets の [rate_limit] で上書き可能）
+RATE_LIMIT_DEFAULTS = {
+    "enabled": True,
+    # プロセス間で共有する状態のファイル
+    "path": "inoki_ratelimit.sqlite3",
+    # NewsAPI は1日の上限があるため、ペースをならして朝のうちに使い切らないようにする
+    "newsapi_rate_per_minute": 1.0,
+    "newsapi_burst": 30,
+    "newsapi_daily_limit": 1000,
+    # 事前取得には使わせず利用者の検索のために残す、バーストと1日の上限の割合
+    "newsapi_reserve": 0.5,
+    # 天気 API は上限はないが、混雑時や障害時に呼び続けない（0 は制限なし）
+    "weather_rate_per_minute": 120.0,
+    "weather_burst": 20,
+    "weather_daily_limit": 0,
+    "weather_reserve": 0.25,
+    # 連続してこの回数失敗したら open_seconds 秒呼び出さない
+    "failure_threshold": 5,
+    "open_seconds": 30.0,
+    # 429 が返り Retry-After がない場合に呼び出さない時間（秒）
+    "rate_limited_seconds": 900.0
+}
+# 呼び出し回数を制限する外部API
+RATE_LIMITED_UPSTREAMS = ("newsapi", "weather")
+
+# レスポンスキャッシュの設定（secrets の [cache] で上書き可能）
+CACHE_DEFAULTS = {
+    "backend": "sqlite",  # "memory" / "sqlite" / "redis"
+    "path": "inoki_cache.sqlite3",
+    "redis_url": "redis://localhost:6379/0",
+    "max_entries": 256,
+    "max_bytes": 16 * 1024 * 1024,
+    "shared_max_bytes": 64 * 1024 * 1024
+}
+# 取得元ごとのキャッシュ有効期限（秒）
+CACHE_TTLS = {
+    "company_news": 30 * 60,
+    "industry_news": 60 * 60,
+    "inoki_message": 6 * 60 * 60
+}
+
+# ニュースのローカル索引の設定（secrets の [news_index] で上書き可能）
+NEWS_INDEX_DEFAULTS = {
+    "enabled": True,
+    "path": "inoki_news.sqlite3",
+    # 検索語ごとに NewsAPI で取得し直すまでの間隔（分）
+    "company_news_coverage_minutes": 6 * 60,
+    "industry_news_coverage_minutes": 3 * 60,
+    # 索引から答える記事の新しさ（日）と保存期間（日）
+    "max_article_age_days": 14,
+    "retention_days": 30,
+    # 取得し直す時期を過ぎていても、しきい値以上の記事がこの件数あれば索引の記事で答え、
+    # 取り直しはバックグラウンドで行う（NEWS_TARGET_ARTICLES 件まで）
+    "min_local_results": 3,
+    # ニュース評価の idf を索引の記事から作り直す間隔（分）
+    "idf_refresh_minutes": 60
+}
+# 索引から取り出して評価する記事の最大数
+NEWS_INDEX_CANDIDATES = 50
+
+# NewsAPI のページ取得（secrets の [news_paging] で上書き可能）
+NEWS_PAGING_DEFAULTS = {
+    # 最初のページの件数（以降は取得済みの件数と同じだけ次を取得し、1回ごとに倍になる）
+    "company_news_first_page_size": 5,
+    "industry_news_first_page_size": 10,
+    # 1回の検索で取得する記事の最大数
+    "max_articles": 40,
+    # 2ページ目以降の取得に使う NewsAPI の1日あたりの上限
+    "daily_extra_pages": 200
+}
+# しきい値以上の記事がこの件数見つかればページの取得を打ち切る
+NEWS_TARGET_ARTICLES = 3
+# ページの指定（キャッシュキーには含めるが、索引のカバレッジは検索語ごとに記録する）
+NEWS_PAGING_PARAMS = ("page", "pageSize")
+
+# メッセージ生成のモデル設定
+OPENAI_MODEL = "gpt-3.5-turbo"
+OPENAI_TEMPERATURE = 0.8
+# トークン数の上限（secrets の [openai] で上書き可能）
+OPENAI_DEFAULTS = {
+    "prompt_token_budget": 1000,
+    "max_tokens": 700
+}
+# 出力の長さの見積もり（挨拶・天気・共感・締めの分と、ニュース1件あたりのコメント）
+MESSAGE_BASE_TOKENS = 260
+MESSAGE_TOKENS_PER_NEWS = 70
+# プロンプトに入れるニュースのタイトルの最大文字数
+NEWS_TITLE_MAX_CHARS = 60
+# 同じ入力に対して保持するメッセージのパターン数
+MESSAGE_VARIANTS = 3
+
+# 事前取得の設定（secrets の [prefetch] で上書き可能）
+PREFETCH_DEFAULTS = {
+    "enabled": True,
+    "industry_interval_minutes": 50,
+    # 業界ニュースの事前取得に使う NewsAPI の1日あたりの上限
+    "daily_news_budget": 300,
+    "jitter_seconds": 120
+}
+
+# 猪木画像（中央の列の表示幅に合わせて縮小した JPEG を配信する）
+INOKI_IMAGE_PATH = "inoki.png"
+INOKI_IMAGE_WIDTH = 720
+INOKI_IMAGE_QUALITY = 82
+
+# 天気予報の発表時刻（時）と API に反映されるまでの猶予
+FORECAST_PUBLISH_HOURS = (5, 11, 17)
+FORECAST_PUBLISH_GRACE = timedelta(minutes=10)
+# 発表時刻を過ぎても更新されていない場合の再取得間隔
+FORECAST_RETRY_INTERVAL = timedelta(minutes=10)
+
+# 送信1回あたりの待ち時間の予算（secrets の [deadline] で上書き可能）
+DEADLINE_DEFAULTS = {
+    "total_seconds": 20.0,
+    # 取得元ごとに使える予算の割合（天気とニュースは並行して取得する）
+    "weather_share": 0.25,
+    "news_share": 0.4,
+    # メッセージ生成に最低限残す時間（秒）
+    "llm_min_seconds": 5.0,
+    # 天気 API の応答がこの秒数を超えたら同じリクエストをもう一つ送る（0 で無効）
+    "weather_hedge_delay": 1.0
+}
+
+# API 呼び出しのタイムアウト後、キャッシュで答えるまで待つ猶予（秒）
+FETCH_GRACE_SECONDS = 0.5
+
+# ストリーミング表示の更新間隔（秒）
+STREAM_RENDER_INTERVAL = 0.1
+
+# 生成ジョブの実行（secrets の [jobs] で上書き可能）
+JOBS_DEFAULTS = {
+    # 同時に実行する生成ジョブの数（ジョブはほとんど外部APIの応答を待っているため多めに取る。
+    # 超えた送信は順番を待ち、待った時間も締め切りの予算に含める）
+    "max_workers": 32,
+    # 終わったジョブの結果を同じ入力の送信に返す期間（秒）
+    "result_ttl_seconds": 300.0,
+    "max_jobs": 200
+}
+# セッションごとに保持する生成結果の数（再実行時の表示と同じ入力の送信に使う）
+SESSION_RESULTS_MAX = 5
+
+# 計測値の書き出し（secrets の [metrics] で上書き可能）
+METRICS_DEFAULTS = {
+    # Prometheus 形式の /metrics を返すポート（0 で無効）
+    "port": 9464,
+    "host": "127.0.0.1",
+    # 計測値を定期的に書き出すファイル（空文字で無効）
+    "file": "",
+    "file_interval_seconds": 15.0
+}
+
+###################
+# HTTP 接続の共有
+###################
+
+@st.cache_resource
+def get_http_session(base_url: str) -> requests.Session:
+    """接続先ホストごとにプロセス全体で共有するセッション（Keep-Alive・接続プール付き）"""
+    # 読み込みのタイムアウトは締め切りを超えないよう再試行しない
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        read=0,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"])
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount(base_url, adapter)
+    return session
+
+def http_timeout(timeout: Optional[float]) -> Tuple[float, float]:
+    """requests に渡す (接続, 読み込み) のタイムアウト"""
+    timeout = HTTP_DEFAULT_TIMEOUT if timeout is None else max(timeout, 0.1)
+    return min(HTTP_CONNECT_TIMEOUT, timeout), timeout
+
+def get_endpoint(name: str) -> Optional[str]:
+    """外部APIの接続先"""
+    return {**ENDPOINT_DEFAULTS, **st.secrets.get("endpoints", {})}[name]
+
+def get_deadline_settings() -> Dict:
+    """締め切りの設定"""
+    return {**DEADLINE_DEFAULTS, **st.secrets.get("deadline", {})}
+
+@st.cache_resource
+def get_hedge_executor() -> ThreadPoolExecutor:
+    """重複リクエスト（ヘッジ）用のスレッドプール
+
+    実行中のジョブがそれぞれ天気の呼び出しを2つまで送っても待たないだけの大きさにする
+    """
+    settings = {**JOBS_DEFAULTS, **st.secrets.get("jobs", {})}
+    return ThreadPoolExecutor(max_workers=2 * int(settings["max_workers"]), thread_name_prefix="hedge")
+
+@st.cache_resource
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """外部APIの呼び出し回数の制限とサーキットブレーカー（プロセス間で共有。無効なら None）"""
+    settings = {**RATE_LIMIT_DEFAULTS, **st.secrets.get("rate_limit", {})}
+    if not settings["enabled"]:
+        return None
+
+    limits = {
+        upstream: {
+            name: float(settings[f"{upstream}_{name}"])
+            for name in ("rate_per_minute", "burst", "daily_limit", "reserve")
+        }
+        for upstream in RATE_LIMITED_UPSTREAMS
+    }
+    try:
+        return RateLimiter(
+            settings["path"], limits,
+            failure_threshold=int(settings["failure_threshold"]),
+            open_seconds=float(settings["open_seconds"]),
+            rate_limited_seconds=float(settings["rate_limited_seconds"])
+        )
+    except Exception as e:
+        print(f"呼び出し回数の制限を初期化できませんでした: {str(e)}")
+        return None
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Retry-After ヘッダーの秒数（秒数で指定されていなければ None）"""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+###################
+# レスポンスキャッシュ
+###################
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """プロセス全体で共有するレスポンスキャッシュ"""
+    settings = {**CACHE_DEFAULTS, **st.secrets.get("cache", {})}
+    ttls = {**CACHE_TTLS, **settings.get("ttls", {})}
+
+    backend = None
+    try:
+        if settings["backend"] == "sqlite":
+            backend = SQLiteBackend(settings["path"], settings["shared_max_bytes"])
+        elif settings["backend"] == "redis":
+            backend = RedisBackend(settings["redis_url"])
+    except Exception as e:
+        # 共有キャッシュが使えない場合はプロセス内キャッシュのみで動かす
+        print(f"共有キャッシュを初期化できませんでした: {str(e)}")
+
+    return ResponseCache(
+        backend=backend,
+        ttls=ttls,
+        max_entries=settings["max_entries"],
+        max_bytes=settings["max_bytes"]
+    )
+
+def get_news_index_settings() -> Dict:
+    """ニュースのローカル索引の設定"""
+    return {**NEWS_INDEX_DEFAULTS, **st.secrets.get("news_index", {})}
+
+def get_news_paging_settings() -> Dict:
+    """NewsAPI のページ取得の設定"""
+    return {**NEWS_PAGING_DEFAULTS, **st.secrets.get("news_paging", {})}
+
+@st.cache_resource
+def get_news_page_budget() -> QuotaBudget:
+    """2ページ目以降の取得回数の1日あたりの上限（プロセス全体で共有）"""
+    return QuotaBudget(int(get_news_paging_settings()["daily_extra_pages"]))
+
+@st.cache_resource
+def get_news_refresh_queue() -> RefreshQueue:
+    """索引の記事で答えた検索語を NewsAPI で取り直すキュー（プロセス全体で共有）"""
+    return RefreshQueue()
+
+@st.cache_resource
+def get_news_index() -> Optional[NewsIndex]:
+    """取得した記事のローカル索引（使えない場合は None）"""
+    settings = get_news_index_settings()
+    if not settings["enabled"]:
+        return None
+    try:
+        return NewsIndex(settings["path"], settings["retention_days"])
+    except Exception as e:
+        # FTS5（trigram）に対応していない SQLite など
+        print(f"ニュースの索引を初期化できませんでした: {str(e)}")
+        return None
+
+@st.cache_resource
+def get_news_idf_holder() -> Dict:
+    """索引の記事から作った idf と作成時刻（プロセス全体で共有）"""
+    return {"idf": None, "built_at": 0.0, "lock": threading.Lock()}
+
+def get_news_idf() -> NgramIdf:
+    """ニュース評価に使う idf（索引の記事から一定間隔で作り直す。索引がなければ一様）
+
+    ページや検索ごとの記事群ではなく索引全体から求めるため、同じ記事の順位が取得の仕方で変わらない
+    """
+    holder = get_news_idf_holder()
+    refresh = float(get_news_index_settings()["idf_refresh_minutes"]) * 60
+    if holder["idf"] is not None and time.time() - holder["built_at"] < refresh:
+        return holder["idf"]
+    # 作り直しは1スレッドだけが行い、その間はほかのスレッドは前の idf を使う
+    if not holder["lock"].acquire(blocking=holder["idf"] is None):
+        return holder["idf"]
+    try:
+        if holder["idf"] is None or time.time() - holder["built_at"] >= refresh:
+            news_index = get_news_index()
+            try:
+                holder["idf"] = NgramIdf(news_index.texts() if news_index else ())
+            except Exception as e:
+                print(f"ニュース評価の idf を作れませんでした: {str(e)}")
+                holder["idf"] = holder["idf"] or NgramIdf()
+            holder["built_at"] = time.time()
+        return holder["idf"]
+    finally:
+        holder["lock"].release()
+
+###################
+# 計測
+###################
+
+@st.cache_resource
+def get_metrics() -> Dict:
+    """処理段階ごとの時間・外部APIの応答・キャッシュ・トークン数の計測値（プロセス全体で共有）"""
+    registry = MetricsRegistry()
+    metrics = {
+        "registry": registry,
+        "stage_seconds": registry.histogram(
+            "inoki_stage_duration_seconds", "送信1回の処理段階ごとの所要時間"
+        ),
+        "stage_fallbacks": registry.counter(
+            "inoki_stage_fallbacks_total", "締め切り超過やエラーで代わりの値を使った回数"
+        ),
+        "upstream_seconds": registry.histogram(
+            "inoki_upstream_request_duration_seconds", "外部APIへのリクエストの所要時間"
+        ),
+        "upstream_responses": registry.counter(
+            "inoki_upstream_responses_total", "外部APIの応答数（ステータスコードまたはエラーの種類別）"
+        ),
+        "upstream_retries": registry.counter(
+            "inoki_upstream_retries_total", "外部APIへのリクエストの再試行回数"
+        ),
+        "news_lookups": registry.counter(
+            "inoki_news_lookups_total", "ニュース検索の回数（ローカル索引で答えたか、取り直し中の索引で答えたか、NewsAPI に問い合わせたか、制限中で索引だけで答えたか）"
+        ),
+        "news_page_stops": registry.counter(
+            "inoki_news_page_stops_total", "NewsAPI のページ取得を終えた理由（十分な記事・結果の終わり・上限など）"
+        ),
+        "upstream_rejections": registry.counter(
+            "inoki_upstream_rejections_total",
+            "呼び出し回数の制限やサーキットブレーカーで外部APIを呼び出さなかった回数（理由別）"
+        ),
+        "job_submits": registry.counter(
+            "inoki_job_submits_total",
+            "生成の送信数（新しく開始したか、実行中・完了済みのジョブに合流したか、セッションの結果を使ったか）"
+        )
+    }
+
+    cache = get_response_cache()
+    ledger = get_usage_ledger()
+
+    def collect_cache() -> List:
+        stats = cache.stats()
+        lookups = [
+            ({"source": source, "result": result}, count)
+            for source, counts in stats.items()
+            for result, count in counts.items()
+        ]
+        ratios = []
+        for source, counts in stats.items():
+            # 期限切れの値の利用と取得待ちはミスの内訳として数える
+            hits = counts["memory_hits"] + counts["shared_hits"]
+            total = hits + counts["misses"]
+            ratios.append(({"source": source}, hits / total if total else 0.0))
+        return [
+            ("inoki_cache_lookups_total", "counter", "キャッシュの参照数（結果別）", lookups),
+            ("inoki_cache_hit_ratio", "gauge", "キャッシュの参照のうち有効な値が見つかった割合", ratios),
+            ("inoki_cache_fetches_in_flight", "gauge", "キャッシュになく取得中の値の数（同時の呼び出しはまとめて1件）",
+             [({}, cache.in_flight())])
+        ]
+
+    def collect_tokens() -> List:
+        totals = ledger.totals()
+        collected = [
+            ("inoki_llm_requests_total", "counter", "メッセージ生成のリクエスト数",
+             [({}, totals["requests"])]),
+            ("inoki_llm_tokens_total", "counter", "メッセージ生成で使ったトークン数",
+             [({"type": "prompt"}, totals["prompt_tokens"]),
+              ({"type": "completion"}, totals["completion_tokens"])])
+        ]
+        # 直近のリクエストで、見積もりと上限に対して実際にどれだけ使ったか（予算の調整用）
+        records = [
+            record for record in ledger.records()
+            if record["prompt_tokens"] is not None and record["completion_tokens"] is not None
+        ]
+        if records:
+            estimated = sum(record["estimated_prompt_tokens"] for record in records)
+            budgeted = sum(record["max_tokens"] for record in records)
+            collected += [
+                ("inoki_llm_prompt_estimate_ratio", "gauge", "直近のプロンプトのトークン数の実績と見積もりの比",
+                 [({}, sum(record["prompt_tokens"] for record in records) / max(estimated, 1))]),
+                ("inoki_llm_completion_budget_ratio", "gauge", "直近の出力のトークン数の実績と上限（max_tokens）の比",
+                 [({}, sum(record["completion_tokens"] for record in records) / max(budgeted, 1))])
+            ]
+        return collected
+
+    def collect_limits() -> List:
+        limiter = get_rate_limiter()
+        if limiter is None:
+            return []
+        states = limiter.states()
+        return [
+            ("inoki_upstream_quota_remaining", "gauge", "外部APIの今日の残り呼び出し回数",
+             [({"upstream": upstream}, state["remaining"])
+              for upstream, state in states.items() if state["remaining"] is not None]),
+            ("inoki_upstream_circuit_open", "gauge", "サーキットブレーカーが開いているか（1 で呼び出しを止めている）",
+             [({"upstream": upstream}, 1 if state["open"] else 0) for upstream, state in states.items()])
+        ]
+
+    def collect_jobs() -> List:
+        return [
+            ("inoki_jobs_in_flight", "gauge", "実行中・実行待ちの生成ジョブの数", [({}, get_job_queue().in_flight())])
+        ]
+
+    registry.add_collector(collect_cache)
+    registry.add_collector(collect_tokens)
+    registry.add_collector(collect_limits)
+    registry.add_collector(collect_jobs)
+    return metrics
+
+@st.cache_resource
+def start_metrics_exporter() -> None:
+    """計測値の書き出しを開始する（プロセスごとに1回）"""
+    settings = {**METRICS_DEFAULTS, **st.secrets.get("metrics", {})}
+    registry = get_metrics()["registry"]
+
+    if settings["port"]:
+        try:
+            start_http_exporter(registry, int(settings["port"]), settings["host"])
+        except OSError as e:
+            # 同じホストで複数のプロセスを動かしている場合など
+            print(f"計測値のエンドポイントを開始できませんでした: {str(e)}")
+    if settings["file"]:
+        start_file_exporter(registry, settings["file"], settings["file_interval_seconds"])
+
+def observed_request(
+    upstream: str,
+    request: Callable[[], requests.Response],
+    background: bool = False
+) -> requests.Response:
+    """外部APIへのリクエストの所要時間・ステータスコード・再試行回数を記録する
+
+    呼び出し回数の制限中やサーキットブレーカーが開いている間はリクエストを送らず、
+    UpstreamUnavailable を送出する（呼び出し側はキャッシュで答える）。
+    background（事前取得）のリクエストは、利用者の検索のための回数を残して断る
+    """
+    metrics = get_metrics()
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        try:
+            limiter.acquire(upstream, background=background)
+        except UpstreamUnavailable as e:
+            metrics["upstream_rejections"].inc(upstream=upstream, reason=e.reason)
+            raise
+
+    started_at = time.perf_counter()
+    try:
+        response = request()
+    except Exception as e:
+        metrics["upstream_responses"].inc(upstream=upstream, status=type(e).__name__)
+        if limiter is not None:
+            limiter.record_failure(upstream)
+        raise
+    finally:
+        metrics["upstream_seconds"].observe(time.perf_counter() - started_at, upstream=upstream)
+
+    metrics["upstream_responses"].inc(upstream=upstream, status=str(response.status_code))
+    if limiter is not None:
+        # 429 は取得元の制限、5xx は障害として数える（それ以外のエラーは取得元の不調ではない）
+        if response.status_code == 429:
+            limiter.record_failure(upstream, rate_limited=True, retry_after=retry_after_seconds(response))
+        elif response.status_code >= 500:
+            limiter.record_failure(upstream)
+        else:
+            limiter.record_success(upstream)
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        metrics["upstream_retries"].inc(len(retries.history), upstream=upstream)
+    return response
+
 ###################
 # Weather API 関連の実装
 ###################
 
-def get_weather_info(city: str, target_date: date) -> Dict:
-    """指定された地域と日付の天気予報を取得"""
+@st.cache_resource
+def get_area_index() -> AreaIndex:
+    """市区町村から予報区域への対応表（初めて使うときに作り、選択肢がすべて揃っているか確かめる）"""
+    return AreaIndex(LOCATIONS)
+
+def default_weather_info() -> Dict:
+    """天気情報が取得できなかった場合の値"""
+    return {
+        "temperature_text": "データなし",
+        "description": "天気情報を取得できませんでした",
+        "telop": "不明",
+        "image_url": None,
+        "is_reference": False,
+        "days_ahead": None
+    }
+
+def get_weather_info(
+    city: str,
+    target_date: date,
+    prefecture: Optional[str] = None,
+    timeout: Optional[float] = None
+) -> Dict:
+    """指定された地域と日付の天気予報を取得（timeout は API 呼び出しの待ち時間、秒）"""
     try:
         # 地域コードの取得
-        city_code = CITY_CODES.get(city)
+        city_code = get_area_index().resolve(city, prefecture)
         if not city_code:
             raise ValueError(f"未対応の地域です: {city}")
 
@@ -132,17 +661,19 @@ def get_weather_info(city: str, target_date: date) -> Dict:
                 "days_ahead": days_ahead
             }
 
-        # API呼び出し
-        url = f"https://weather.tsukumijima.net/api/forecast/city/{city_code}"
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        # JSONデータの取得
-        weather_data = response.json()
-        
-        # 予報日のインデックスを決定（0:今日, 1:明日, 2:明後日）
-        forecast_index = min(days_ahead, len(weather_data["forecasts"])-1)
-        target_forecast = weather_data["forecasts"][forecast_index]
+        # 予報区域の予報データを取得
+        weather_data = get_area_forecast(city_code, timeout=timeout)
+        forecasts = weather_data["forecasts"]
+
+        # 予報日が一致する予報を使う（保持中に日付が変わっても正しい日を選ぶ）
+        target_forecast = next(
+            (forecast for forecast in forecasts if forecast.get("date") == target_date.isoformat()),
+            None
+        )
+        if target_forecast is None:
+            # 予報日のインデックスを決定（0:今日, 1:明日, 2:明後日）
+            forecast_index = min(days_ahead, len(forecasts)-1)
+            target_forecast = forecasts[forecast_index]
         
         # 気温の取得
         temp_max = target_forecast["temperature"]["max"]["celsius"] if target_forecast["temperature"]["max"] else None
@@ -173,44 +704,114 @@ def get_weather_info(city: str, target_date: date) -> Dict:
 
     except Exception as e:
         print(f"エラーが発生しました: {str(e)}")
-        return {
-            "temperature_text": "データなし",
-            "description": "天気情報を取得できませんでした",
-            "telop": "不明",
-            "image_url": None,
-            "is_reference": False,
-            "days_ahead": None
-        }
+        return default_weather_info()
+
+def next_publish_slot(after: datetime) -> Optional[datetime]:
+    """after より後の最初の予報の発表枠（発表時刻、JST）"""
+    after = after.astimezone(JST)
+    for days in range(2):
+        base = datetime.combine(after.date() + timedelta(days=days), datetime.min.time(), JST)
+        for hour in FORECAST_PUBLISH_HOURS:
+            publish_at = base.replace(hour=hour)
+            if publish_at > after:
+                return publish_at
+    return None
+
+def next_forecast_update(public_time: Optional[str]) -> datetime:
+    """予報の発表時刻から次に予報が更新される時刻を求める"""
+    now = datetime.now(JST)
+    try:
+        publish_at = next_publish_slot(date_parser.isoparse(public_time))
+    except (TypeError, ValueError):
+        return now + FORECAST_RETRY_INTERVAL
+    if publish_at is None:
+        return now + FORECAST_RETRY_INTERVAL
+
+    # 更新が遅れている場合は少し待ってから取り直す
+    update_at = publish_at + FORECAST_PUBLISH_GRACE
+    return update_at if update_at > now else now + FORECAST_RETRY_INTERVAL
+
+def forecast_ttl(weather_data: Dict) -> float:
+    """予報データの有効期限（次の予報発表まで、秒）"""
+    expires_at = next_forecast_update(weather_data.get("publicTime"))
+    return (expires_at - datetime.now(JST)).total_seconds()
+
+def get_area_forecast(
+    area_code: str,
+    refresh: bool = False,
+    timeout: Optional[float] = None
+) -> Dict:
+    """予報区域の天気予報データを取得
+
+    同じ区域の市区町村・日付はすべて一つの予報データから答えるため、
+    予報区域コードをキーに次の予報発表までキャッシュする。
+    refresh を指定するとキャッシュを使わずに取得し直す（事前取得用。呼び出し回数は
+    利用者の検索のための分を残して使う）。
+    取得に失敗した場合は期限切れの予報があればそれを使う
+    """
+    def request(request_timeout: Optional[float]) -> Dict:
+        base_url = get_endpoint("weather")
+        url = f"{base_url}/api/forecast/city/{area_code}"
+        response = observed_request(
+            "weather",
+            lambda: get_http_session(base_url).get(url, timeout=http_timeout(request_timeout)),
+            background=refresh
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def fetch() -> Dict:
+        # 天気 API は冪等なので、応答が遅い場合は同じリクエストをもう一つ送る
+        hedge_delay = get_deadline_settings()["weather_hedge_delay"]
+        if hedge_delay > 0:
+            # 遅れて送る方も含めて timeout までに終える（過ぎたら期限切れの予報で答える）
+            return hedged(request, hedge_delay, get_hedge_executor(), timeout)
+        return request(timeout)
+
+    cache = get_response_cache()
+    if refresh:
+        return cache.refresh("weather", area_code, fetch, ttl=forecast_ttl)
+    # 同じ区域の取得が進行中なら、その結果を待つ（待つのは自分のタイムアウトまで）
+    return cache.get_or_fetch("weather", area_code, fetch, ttl=forecast_ttl, wait_timeout=timeout)
 
 ###################
 # OpenAI API 関連の実装
 ###################
 
-def generate_inoki_message(
-    company_name: str, 
+@st.cache_resource
+def get_openai_client():
+    """プロセス全体で共有する OpenAI クライアント"""
+    from openai import OpenAI
+
+    return OpenAI(
+        api_key=st.secrets["api_keys"]["openai_api"],
+        base_url=get_endpoint("openai"),
+        timeout=OPENAI_DEFAULT_TIMEOUT
+    )
+
+@st.cache_resource
+def get_usage_ledger() -> UsageLedger:
+    """トークン使用量の記録（プロセス全体で共有）"""
+    return UsageLedger()
+
+def build_inoki_prompt(
+    company_name: str,
     industry_category: str,
     industry_detail: str,
-    city: str, 
-    weather_info: dict, 
-    company_news: list, 
+    city: str,
+    weather_info: dict,
+    company_news: list,
     industry_news: list
-) -> str:
-    """OpenAI APIを使用して猪木風メッセージを生成"""
-    try:
-        from openai import OpenAI
-        
-        # クライアントの初期化
-        client = OpenAI(api_key=st.secrets["api_keys"]["openai_api"])
-        
-        # ニュースの整形
-        news_text = ""
-        if company_news:
-            news_text += f"\n企業ニュース:\n" + "\n".join([f"- {news['title']}" for news in company_news[:3]])
-        if industry_news:
-            news_text += f"\n業界ニュース:\n" + "\n".join([f"- {news['title']}" for news in industry_news[:3]])
+) -> Tuple[str, str, int]:
+    """猪木風メッセージのプロンプトと出力トークンの上限を作成
+
+    ニュースは入力トークンの予算に収まるよう切り詰め、出力の上限は
+    プロンプトに含めたニュースの件数から決める
+    """
+    settings = {**OPENAI_DEFAULTS, **st.secrets.get("openai", {})}
 
-        # システムプロンプトの作成
-        system_prompt = """あなたはプロレスラーのアントニオ猪木として話します。以下の特徴を持つメッセージを生成してください：
+    # システムプロンプトの作成
+    system_prompt = """あなたはプロレスラーのアントニオ猪木として話します。以下の特徴を持つメッセージを生成してください：
 
 話し方の特徴：
 - リズム感のある短いフレーズ
@@ -218,46 +819,214 @@ def generate_inoki_message(
 - 闘魂や元気を感じさせるフレーズを自然に挿入
 - ビジネスに適した丁寧さを維持"""
 
+    def render_prompt(company_lines: List[str], industry_lines: List[str]) -> str:
+        # ニュースの整形
+        news_text = ""
+        if company_lines:
+            news_text += f"\n企業ニュース:\n" + "\n".join(company_lines)
+        if industry_lines:
+            news_text += f"\n業界ニュース:\n" + "\n".join(industry_lines)
+
+        # メッセージの要件（ニュースの件数に合わせる）
+        requirements = [
+            "「元気ですかー！ 元気があれば何でもできる。」からスタート。",
+            "次に天気に触れた前向きな挨拶",
+            "業界の現状や御社の取り組みへの共感"
+        ]
+        if company_lines:
+            requirements.append(f"企業ニュースに対するコメント（{len(company_lines)}件）")
+        if industry_lines:
+            requirements.append(f"業界ニュースの展望（{len(industry_lines)}件）")
+        requirements.append("最後に「それでは本日も張り切って参りましょう。123ダー！」で締める")
+        requirements_text = "\n".join(f"{i}. {line}" for i, line in enumerate(requirements, start=1))
+
         # ユーザープロンプトの作成
-        prompt = f"""以下の情報を元に、猪木風のビジネス挨拶メッセージを生成してください。
+        return f"""以下の情報を元に、猪木風のビジネス挨拶メッセージを生成してください。
 
 基本情報:
-- 会社名: {company_name}
+- 会社名: {company_name.strip()}
 - 業界: {industry_category}（{industry_detail}）
 - 場所: {city}
 - 天気: {weather_info['telop']} ({weather_info['temperature_text']})
 {news_text}
 
 ### メッセージの要件
-1. 「元気ですかー！ 元気があれば何でもできる。」からスタート。
-1. 次に天気に触れた前向きな挨拶
-2. 業界の現状や御社の取り組みへの共感
-3. 企業ニュースに対するコメント（3件）
-4. 業界ニュースの展望（3件）
-5. 最後に「それでは本日も張り切って参りましょう。123ダー！」で締める
+{requirements_text}
 
 ### フレーズ例
 - 「燃える闘魂を感じました！」
 - 「この調子で、元気いっぱいで参りましょう！」
 - 「闘魂注入！」"""
 
-        # ChatGPT APIの呼び出し
+    # ニュースを入力トークンの予算に収める
+    company_lines = [f"- {truncate_text(news['title'], NEWS_TITLE_MAX_CHARS)}" for news in company_news[:3]]
+    industry_lines = [f"- {truncate_text(news['title'], NEWS_TITLE_MAX_CHARS)}" for news in industry_news[:3]]
+    base_tokens = count_tokens(system_prompt + render_prompt([], []), OPENAI_MODEL)
+    company_lines, industry_lines = fit_to_budget(
+        [company_lines, industry_lines],
+        settings["prompt_token_budget"] - base_tokens,
+        OPENAI_MODEL
+    )
+    prompt = render_prompt(company_lines, industry_lines)
+
+    # 要件の構成に必要な分だけ出力を許す
+    max_tokens = min(
+        settings["max_tokens"],
+        MESSAGE_BASE_TOKENS + MESSAGE_TOKENS_PER_NEWS * (len(company_lines) + len(industry_lines))
+    )
+
+    return system_prompt, prompt, max_tokens
+
+class TruncatedCompletion(Exception):
+    """出力の上限で生成が打ち切られた（message は途中までの本文）"""
+
+    def __init__(self, message: str):
+        super().__init__("メッセージが出力の上限で打ち切られました")
+        self.message = message
+
+def request_inoki_completion(
+    system_prompt: str,
+    prompt: str,
+    max_tokens: int,
+    on_chunk: Optional[Callable[[str], None]] = None,
+    timeout: Optional[float] = None
+) -> str:
+    """ChatGPT APIでメッセージを生成（失敗時は例外を送出）
+
+    on_chunk を渡すとストリーミングで生成し、途中までの本文を随時渡す。
+    max_tokens で打ち切られた場合は TruncatedCompletion を送出する
+    """
+    # 共有クライアントの取得
+    client = get_openai_client()
+
+    # ChatGPT APIの呼び出し
+    options = {"stream": True, "stream_options": {"include_usage": True}} if on_chunk else {}
+    if timeout is not None:
+        options["timeout"] = timeout
+    metrics = get_metrics()
+    started_at = time.perf_counter()
+    try:
         response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+            model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=700,
-            temperature=0.8
+            max_tokens=max_tokens,
+            temperature=OPENAI_TEMPERATURE,
+            **options
+        )
+
+        if on_chunk is None:
+            message = response.choices[0].message.content
+            finish_reason = response.choices[0].finish_reason
+            usage = response.usage
+        else:
+            # 届いた分から順に表示する（使用量は最後のチャンクで届く）
+            message = ""
+            finish_reason = None
+            usage = None
+            last_rendered_at = 0.0
+            for chunk in response:
+                usage = getattr(chunk, "usage", None) or usage
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                message += chunk.choices[0].delta.content
+                if time.monotonic() - last_rendered_at >= STREAM_RENDER_INTERVAL:
+                    on_chunk(message)
+                    last_rendered_at = time.monotonic()
+    except Exception as e:
+        # API のエラーはステータスコード、それ以外はエラーの種類で記録する
+        status = getattr(e, "status_code", None) or type(e).__name__
+        metrics["upstream_responses"].inc(upstream="openai", status=str(status))
+        raise
+    finally:
+        metrics["upstream_seconds"].observe(time.perf_counter() - started_at, upstream="openai")
+    metrics["upstream_responses"].inc(upstream="openai", status="200")
+
+    # トークン使用量の記録
+    prompt_tokens = usage.prompt_tokens if usage else None
+    completion_tokens = usage.completion_tokens if usage else None
+    get_usage_ledger().record(
+        OPENAI_MODEL, prompt_tokens, completion_tokens,
+        count_tokens(system_prompt + prompt, OPENAI_MODEL), max_tokens
+    )
+
+    if not message:
+        raise ValueError("メッセージが空です")
+    if on_chunk is not None:
+        on_chunk(message)
+    if finish_reason == "length":
+        raise TruncatedCompletion(message)
+    return message
+
+@st.cache_resource
+def get_message_pool() -> VariantPool:
+    """生成済みメッセージのプール（プロセス全体で共有）"""
+    return VariantPool(get_response_cache(), "inoki_message", MESSAGE_VARIANTS)
+
+def generate_inoki_message(
+    company_name: str, 
+    industry_category: str,
+    industry_detail: str,
+    city: str, 
+    weather_info: dict, 
+    company_news: list, 
+    industry_news: list,
+    on_chunk: Optional[Callable[[str], None]] = None,
+    timeout: Optional[float] = None
+) -> str:
+    """OpenAI APIを使用して猪木風メッセージを生成
+
+    on_chunk を渡すとストリーミングで生成し、途中までの本文を随時渡す。
+    同じ入力のメッセージは生成済みのものを順番に返す。
+    timeout を過ぎた場合はフォールバックのメッセージを返す
+    """
+    try:
+        system_prompt, prompt, max_tokens = build_inoki_prompt(
+            company_name, industry_category, industry_detail,
+            city, weather_info, company_news, industry_news
         )
-        
-        return response.choices[0].message.content
+
+        # 入力（プロンプト）とモデルの設定が同じなら生成済みのメッセージを使う
+        pool = get_message_pool()
+        pool_key = {
+            "model": OPENAI_MODEL,
+            "max_tokens": max_tokens,
+            "temperature": OPENAI_TEMPERATURE,
+            "system": system_prompt,
+            "prompt": prompt
+        }
+        message = pool.next(pool_key)
+        if message is not None:
+            # 繰り返し使われる入力はバックグラウンドで別パターンを追加する
+            pool.fill_async(
+                pool_key, lambda: request_inoki_completion(system_prompt, prompt, max_tokens)
+            )
+            if on_chunk is not None:
+                on_chunk(message)
+            return message
+
+        message = request_inoki_completion(system_prompt, prompt, max_tokens, on_chunk, timeout)
+        pool.add(pool_key, message)
+        return message
+
+    except TruncatedCompletion as e:
+        # 途中で切れたメッセージは今回だけ表示し、プールには入れない
+        # （バックグラウンドの追加では例外になるため入らない）
+        print(f"メッセージが出力の上限で打ち切られました（max_tokens={max_tokens}）")
+        return e.message
 
     except Exception as e:
-        st.error(f"メッセージ生成エラー: {str(e)}")
+        report_error(f"メッセージ生成エラー: {str(e)}")
         # エラー時のフォールバックメッセージ
-        return f"""
+        return fallback_inoki_message(city, industry_category, industry_detail, weather_info)
+
+def fallback_inoki_message(city: str, industry_category: str, industry_detail: str, weather_info: Dict) -> str:
+    """生成できない（または生成を待つ）間の定型メッセージ"""
+    return f"""
         元気があれば何でもできる！本日はありがとうございます！{city}の天気は{weather_info['telop']}、気温は{weather_info['temperature_text']}です。
 
         御社の取り組みには、燃える闘魂を感じております！特に{industry_category}業界における{industry_detail}の挑戦に敬意を表します。
@@ -269,89 +1038,199 @@ def generate_inoki_message(
 # News API 関連の実装
 ###################
 
-def get_company_news(company_name: str) -> List[Dict]:
-    """会社名でニュースを検索"""
-    base_url = "https://newsapi.org/v2/everything"
-    api_key = st.secrets["api_keys"]["news_api"]
-    
+def search_news(
+    source: str,
+    params: Dict,
+    refresh: bool = False,
+    ttl: Optional[float] = None,
+    timeout: Optional[float] = None
+) -> Dict:
+    """NewsAPI の記事検索（結果は取得元ごとの有効期限でキャッシュ）
+
+    refresh を指定するとキャッシュを使わずに取得し直して保存する（事前取得用。呼び出し回数は
+    利用者の検索のための分を残して使う）。
+    取得に失敗した場合は期限切れの結果があればそれを使う
+    """
+    def fetch() -> Dict:
+        base_url = get_endpoint("news")
+        response = observed_request("newsapi", lambda: get_http_session(base_url).get(
+            f"{base_url}/v2/everything",
+            params={**params, "apiKey": st.secrets["api_keys"]["news_api"]},
+            timeout=http_timeout(timeout)
+        ), background=refresh)
+        response.raise_for_status()
+        news_data = response.json()
+        if news_data["status"] != "ok":
+            raise ValueError(news_data.get("message", "NewsAPI がエラーを返しました"))
+
+        # 取得した記事はローカル索引にも保存し、この検索語を取得済みとして記録する
+        index = get_news_index()
+        if index is not None:
+            try:
+                index.ingest(news_data["articles"])
+                index.mark_covered(ResponseCache.make_key(source, news_query(params)))
+            except Exception as e:
+                print(f"ニュースの索引に保存できませんでした: {str(e)}")
+        return news_data
+
+    # API キーはキャッシュキーに含めない
+    cache = get_response_cache()
+    if refresh:
+        return cache.refresh(source, params, fetch, ttl)
+    return cache.get_or_fetch(source, params, fetch, ttl, wait_timeout=timeout)
+
+def news_query(params: Dict) -> Dict:
+    """ページの指定を除いた検索条件"""
+    return {key: value for key, value in params.items() if key not in NEWS_PAGING_PARAMS}
+
+def news_page_plan(first_page_size: int, max_articles: int) -> List[Tuple[int, int]]:
+    """取得するページ (page, pageSize) の順番
+
+    最初は小さいページを取り、以降は取得済みの件数と同じ大きさの2ページ目を取る
+    （取得する範囲は途切れずに続き、取得済みの件数は1回ごとに倍になる）。
+    first_page_size は1件以上にする（0 以下では件数が増えず終わらないため）
+    """
+    first_page_size = max(1, first_page_size)
+    plan = [(1, first_page_size)]
+    fetched = first_page_size
+    while fetched < max_articles:
+        plan.append((2, fetched))
+        fetched *= 2
+    return plan
+
+def search_news_pages(
+    source: str,
+    params: Dict,
+    score: Callable[[List[Dict]], List[Dict]],
+    budget: QuotaBudget,
+    articles: Optional[List[Dict]] = None,
+    refresh: bool = False,
+    ttl: Optional[float] = None,
+    timeout: Optional[float] = None
+) -> List[Dict]:
+    """NewsAPI を小さいページから順に取得して評価し、評価済みの記事を返す
+
+    articles（索引の記事など）と合わせてしきい値以上の記事が NEWS_TARGET_ARTICLES 件に
+    なるか、結果の終わりか最大数に達したら打ち切る。2ページ目以降は budget と
+    timeout の範囲内で取得し、失敗した場合はそれまでの記事で評価する
+    """
+    settings = get_news_paging_settings()
+    metrics = get_metrics()
+    started_at = time.monotonic()
+    # URL で重複を除く
+    collected = {article["url"]: article for article in articles or []}
+    scored = score(list(collected.values()))
+    stop = "max_articles"
+
+    plan = news_page_plan(int(settings[f"{source}_first_page_size"]), int(settings["max_articles"]))
+    for number, (page, page_size) in enumerate(plan):
+        remaining = None if timeout is None else timeout - (time.monotonic() - started_at)
+        if number > 0:
+            if remaining is not None and remaining <= 0:
+                stop = "deadline"
+                break
+            if not budget.try_acquire():
+                stop = "budget"
+                break
+
+        try:
+            news_data = search_news(
+                source, {**params, "page": page, "pageSize": page_size},
+                refresh=refresh, ttl=ttl, timeout=remaining
+            )
+        except Exception as e:
+            if number == 0:
+                raise
+            print(f"ニュースの次のページを取得できませんでした: {source}: {str(e)}")
+            stop = "unavailable" if isinstance(e, UpstreamUnavailable) else "error"
+            break
+
+        page_articles = news_data["articles"]
+        collected.update((article["url"], article) for article in page_articles)
+        scored = score(list(collected.values()))
+        if len(scored) >= NEWS_TARGET_ARTICLES:
+            stop = "enough"
+            break
+        if len(page_articles) < page_size or page * page_size >= news_data.get("totalResults", 0):
+            stop = "exhausted"
+            break
+
+    metrics["news_page_stops"].inc(source=source, reason=stop)
+    return scored
+
+def find_news(
+    source: str,
+    params: Dict,
+    search_terms: List[str],
+    score: Callable[[List[Dict]], List[Dict]],
+    timeout: Optional[float] = None
+) -> List[Dict]:
+    """ローカル索引から記事を探し、足りない場合だけ NewsAPI に問い合わせて評価済みの記事を返す
+
+    検索語を最近 NewsAPI で取得済みなら索引だけで答える。取得し直す時期を過ぎていても
+    索引にしきい値以上の記事が十分あればそれで答え、取り直しはバックグラウンドで行う
+    """
+    index = get_news_index()
+    metrics = get_metrics()
+    local_articles: List[Dict] = []
+    if index is not None:
+        settings = get_news_index_settings()
+        try:
+            since = datetime.now(timezone.utc) - timedelta(days=settings["max_article_age_days"])
+            local_articles = index.search(search_terms, since, NEWS_INDEX_CANDIDATES)
+            scored = score(local_articles)
+            coverage_key = ResponseCache.make_key(source, params)
+            coverage_age = index.coverage_age(coverage_key)
+            if coverage_age is not None and coverage_age < settings[f"{source}_coverage_minutes"] * 60:
+                metrics["news_lookups"].inc(source=source, result="index")
+                return scored
+            if len(scored) >= min(settings["min_local_results"], NEWS_TARGET_ARTICLES):
+                get_news_refresh_queue().submit(coverage_key, lambda: search_news_pages(
+                    source, params, score, get_news_page_budget(), articles=local_articles, refresh=True
+                ))
+                metrics["news_lookups"].inc(source=source, result="stale_index")
+                return scored
+        except Exception as e:
+            print(f"ニュースの索引を検索できませんでした: {str(e)}")
+
+    # 索引の記事と合わせて評価し、足りない分だけページを取得する
+    try:
+        scored = search_news_pages(
+            source, params, score, get_news_page_budget(), articles=local_articles, timeout=timeout
+        )
+    except UpstreamUnavailable as e:
+        # 制限中は待たずに索引の記事だけで答える（エラーは画面に出さない）
+        print(f"NewsAPI を呼び出さずに索引の記事で答えます: {str(e)}")
+        metrics["news_lookups"].inc(source=source, result="unavailable")
+        return score(local_articles)
+    metrics["news_lookups"].inc(source=source, result="api")
+    return scored
+
+def get_company_news(company_name: str, timeout: Optional[float] = None) -> List[Dict]:
+    """会社名でニュースを検索（timeout は API 呼び出しの待ち時間、秒）"""
     params = {
         "q": company_name,
         "language": "jp",
-        "sortBy": "publishedAt",
-        "pageSize": 10,
-        "apiKey": api_key
+        "sortBy": "publishedAt"
     }
     
     try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        news_data = response.json()
-        
-        if news_data["status"] == "ok" and news_data["articles"]:
-            articles = news_data["articles"]
-            
-            # NGワードリスト
-            ng_words = ["ちょいブス", "エ□", "まとめ", "2ch", "アフィリエイト", "まとめサイト", "速報"]
-            
-            # 記事の評価とフィルタリング
-            scored_articles = []
-            for article in articles:
-                title_lower = article["title"].lower()
-                desc_lower = article["description"].lower() if article["description"] else ""
-                company_lower = company_name.lower()
-                
-                # NGワードチェック
-                if any(ng_word.lower() in title_lower for ng_word in ng_words):
-                    continue
-                
-                # スコア計算
-                score = 0
-                
-                # タイトルに会社名が含まれる
-                if company_lower in title_lower:
-                    score += 5
-                
-                # 説明文に会社名が含まれる
-                if company_lower in desc_lower:
-                    score += 3
-                
-                # 新しい記事ほど高スコア
-                days_old = (datetime.now() - datetime.strptime(article["publishedAt"][:10], "%Y-%m-%d")).days
-                score += max(0, 2 - (days_old * 0.1))
-                
-                # ドメインスコアの追加
-                domain = article["url"].lower()
-                if any(d in domain for d in ["nikkei.com", "reuters.com", "bloomberg.", "nhk.or.jp"]):
-                    score *= 1.5
-                elif any(d in domain for d in ["itmedia.co.jp", "techcrunch.com", "businessinsider.jp"]):
-                    score *= 1.3
-                
-                if score >= 3:  # 最小スコアのしきい値
-                    scored_articles.append({
-                        "title": article["title"],
-                        "description": article["description"],
-                        "url": article["url"],
-                        "published_at": article["publishedAt"],
-                        "relevance_score": score
-                    })
-            
-            # スコアで降順ソートして上位3件を返す
-            return sorted(scored_articles, key=lambda x: x["relevance_score"], reverse=True)[:3]
+        articles = find_news(
+            "company_news", params, [company_name],
+            lambda articles: score_company_articles(
+                articles, company_name, limit=NEWS_TARGET_ARTICLES, idf=get_news_idf()
+            ),
+            timeout=timeout
+        )
+        # スコアの上位3件を返す
+        return articles[:3]
 
     except Exception as e:
-        st.error(f"企業ニュース取得エラー: {str(e)}")
+        report_error(f"企業ニュース取得エラー: {str(e)}")
         return []
-    
-    return []
 
-def get_industry_news(industry_category: str, industry_detail: str) -> List[Dict]:
-    """業界のニュースを検索"""
-    base_url = "https://newsapi.org/v2/everything"
-    api_key = st.secrets["api_keys"]["news_api"]
-    
-    # NGワードリスト
-    ng_words = ["ちょいブス", "エ□", "まとめ", "2ch", "アフィリエイト", "まとめサイト", "速報"]
-    
+def build_industry_query(industry_category: str, industry_detail: str) -> Tuple[List[str], Dict]:
+    """業界ニュースの検索キーワードと検索パラメータを作成"""
     # 業界特有の検索キーワード
     category_keywords = {
         "製造業": ["製造", "メーカー", "工場"],
@@ -391,78 +1270,338 @@ def get_industry_news(industry_category: str, industry_detail: str) -> List[Dict
     # 詳細業種のキーワードを追加
     search_terms.extend(detail_keywords.get(industry_detail, [industry_detail]))
     
-    # 重複を除去してクエリを構築
-    search_terms = list(set(search_terms))
+    # 重複を除去してクエリを構築（プロセスをまたいで同じクエリになるよう順序を保つ）
+    search_terms = list(dict.fromkeys(search_terms))
     search_query = " OR ".join(search_terms)
 
     params = {
         "q": search_query,
         "language": "jp",
-        "sortBy": "publishedAt",
-        "pageSize": 20,
-        "apiKey": api_key
+        "sortBy": "publishedAt"
     }
 
+    return search_terms, params
+
+def get_industry_news(
+    industry_category: str,
+    industry_detail: str,
+    timeout: Optional[float] = None
+) -> List[Dict]:
+    """業界のニュースを検索（timeout は API 呼び出しの待ち時間、秒）"""
+    search_terms, params = build_industry_query(industry_category, industry_detail)
+
     try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        news_data = response.json()
-        
-        if news_data["status"] == "ok" and news_data["articles"]:
-            articles = news_data["articles"]
-            scored_articles = []
-            
-            for article in articles:
-                title_lower = article["title"].lower()
-                desc_lower = article["description"].lower() if article["description"] else ""
-                
-                # NGワードチェック
-                if any(ng_word.lower() in title_lower for ng_word in ng_words):
-                    continue
-                
-                # スコア計算
-                score = 0
-                
-                # キーワードとの関連性チェック
-                for term in search_terms:
-                    if term.lower() in title_lower:
-                        score += 2
-                    if term.lower() in desc_lower:
-                        score += 1
-                
-                # ドメインスコアの追加
-                domain = article["url"].lower()
-                if any(d in domain for d in ["nikkei.com", "reuters.com", "bloomberg.", "nhk.or.jp"]):
-                    score *= 1.5
-                elif any(d in domain for d in ["itmedia.co.jp", "techcrunch.com", "businessinsider.jp"]):
-                    score *= 1.3
-                
-                # 新しさによるスコア
-                days_old = (datetime.now() - datetime.strptime(article["publishedAt"][:10], "%Y-%m-%d")).days
-                score += max(0, 2 - (days_old * 0.1))
-                
-                if score >= 2:  # スコアの閾値を下げる
-                    scored_articles.append({
-                        "title": article["title"],
-                        "description": article["description"],
-                        "url": article["url"],
-                        "published_at": article["publishedAt"],
-                        "relevance_score": score
-                    })
-            
-            # スコアで降順ソートして上位3件を返す
-            return sorted(scored_articles, key=lambda x: x["relevance_score"], reverse=True)[:3]
+        articles = find_news(
+            "industry_news", params, search_terms,
+            lambda articles: score_industry_articles(
+                articles, search_terms, limit=NEWS_TARGET_ARTICLES, idf=get_news_idf()
+            ),
+            timeout=timeout
+        )
+        # スコアの上位3件を返す
+        return articles[:3]
 
     except Exception as e:
-        st.error(f"業界ニュース取得エラー: {str(e)}")
+        report_error(f"業界ニュース取得エラー: {str(e)}")
         return []
 
-    return []
+###################
+# 事前取得
+###################
+
+def next_forecast_slot(now: datetime) -> datetime:
+    """次の予報発表（API への反映後）の時刻"""
+    publish_at = next_publish_slot(now - FORECAST_PUBLISH_GRACE)
+    if publish_at is None:
+        return now + timedelta(hours=6)
+    return publish_at + FORECAST_PUBLISH_GRACE
+
+def prefetch_weather() -> None:
+    """全予報区域の天気予報を取得し直す
+
+    予報は次の発表までキャッシュするため、有効期限内の区域は発表済みの最新の予報を持っている。
+    他のプロセスが共有キャッシュで取り直した区域は取得しない
+    """
+    cache = get_response_cache()
+    for area_code in get_area_index().area_codes():
+        if cache.fresh_for("weather", area_code) > 0:
+            continue
+        try:
+            get_area_forecast(area_code, refresh=True)
+        except UpstreamUnavailable as e:
+            print(f"天気予報の事前取得を中断します: {str(e)}")
+            return
+        except Exception as e:
+            print(f"天気予報の事前取得に失敗しました: {area_code}: {str(e)}")
+
+def prefetch_industry_news(
+    industries: RoundRobin,
+    budget: QuotaBudget,
+    per_cycle: int,
+    ttl: float,
+    interval: float
+) -> None:
+    """業界ニュースを順番に取得し直す（1日の上限の範囲内）
+
+    直近の interval 秒以内に他のプロセスが共有キャッシュで取り直した業種は取得しない
+    （上限を使わない）
+    """
+    cache = get_response_cache()
+    first_page, first_page_size = news_page_plan(
+        int(get_news_paging_settings()["industry_news_first_page_size"]), 1
+    )[0]
+    for industry_category, industry_detail in industries.take(per_cycle):
+        search_terms, params = build_industry_query(industry_category, industry_detail)
+        first_page_params = {**params, "page": first_page, "pageSize": first_page_size}
+        if cache.fresh_for("industry_news", first_page_params) > ttl - interval:
+            continue
+        if not budget.try_acquire():
+            print("業界ニュースの事前取得が1日の上限に達しました")
+            return
+        try:
+            # 2ページ目以降も同じ上限の範囲内で取得する
+            search_news_pages(
+                "industry_news", params,
+                lambda articles: score_industry_articles(
+                    articles, search_terms, limit=NEWS_TARGET_ARTICLES, idf=get_news_idf()
+                ),
+                budget, refresh=True, ttl=ttl
+            )
+        except UpstreamUnavailable as e:
+            # 制限中は残りの業種も取得できないため、次の回に回す
+            print(f"業界ニュースの事前取得を中断します: {str(e)}")
+            return
+        except Exception as e:
+            print(f"業界ニュースの事前取得に失敗しました: {industry_detail}: {str(e)}")
+
+@st.cache_resource
+def start_prefetch_scheduler() -> Optional[PrefetchScheduler]:
+    """天気予報と業界ニュースを事前取得するスケジューラを起動（プロセスごとに1つ）"""
+    settings = {**PREFETCH_DEFAULTS, **st.secrets.get("prefetch", {})}
+    if not settings["enabled"]:
+        return None
+
+    interval = timedelta(minutes=settings["industry_interval_minutes"])
+    industries = RoundRobin([
+        (category, detail) for category, details in INDUSTRIES.items() for detail in details
+    ])
+
+    # 1日の上限を1日の実行回数で割り、1回あたりの取得数を決める
+    cycles_per_day = timedelta(days=1) / interval
+    per_cycle = max(1, math.ceil(settings["daily_news_budget"] / cycles_per_day))
+    # 次に同じ業種を取得し直すまでキャッシュを保持する
+    cycles_per_rotation = math.ceil(len(industries) / per_cycle)
+    ttl = (interval * (cycles_per_rotation + 1)).total_seconds()
+    budget = QuotaBudget(settings["daily_news_budget"])
+
+    scheduler = PrefetchScheduler()
+    scheduler.add_task(
+        "weather", prefetch_weather, next_forecast_slot,
+        jitter=settings["jitter_seconds"]
+    )
+    scheduler.add_task(
+        "industry_news",
+        lambda: prefetch_industry_news(industries, budget, per_cycle, ttl, interval.total_seconds()),
+        lambda now: now + interval,
+        jitter=settings["jitter_seconds"]
+    )
+    scheduler.start()
+    # 終了時は実行中の処理の後に新しい処理を始めない
+    atexit.register(scheduler.stop)
+    return scheduler
+
+###################
+# データ取得の並行処理
+###################
+
+def fetch_visit_data(
+    city: str,
+    visit_date: date,
+    company_name: str,
+    industry_category: str,
+    industry_detail: str,
+    deadline: Deadline,
+    prefecture: Optional[str] = None,
+    on_result: Optional[Callable[[str, object], None]] = None
+) -> Tuple[Dict, List[Dict], List[Dict]]:
+    """天気・企業ニュース・業界ニュースを並行して取得
+
+    各取得元には締め切りの予算の一部を割り当て、超えた場合はキャッシュ
+    （期限切れを含む）か空の結果を使う。
+    on_result を渡すと、取得元ごとに結果（または代わりの値）が決まった時点で一度だけ渡す
+    """
+    settings = get_deadline_settings()
+    timeouts = {
+        "weather": deadline.share(settings["weather_share"]),
+        "company_news": deadline.share(settings["news_share"]),
+        "industry_news": deadline.share(settings["news_share"])
+    }
+    tasks = {
+        "weather": (get_weather_info, (city, visit_date, prefecture), default_weather_info),
+        "company_news": (get_company_news, (company_name,), list),
+        "industry_news": (get_industry_news, (industry_category, industry_detail), list)
+    }
+
+    metrics = get_metrics()
+
+    delivered = set()
+    delivered_lock = threading.Lock()
+
+    def deliver(name: str, value: object) -> None:
+        if on_result is None:
+            return
+        with delivered_lock:
+            if name in delivered:
+                return
+            delivered.add(name)
+        on_result(name, value)
+
+    def timed(name: str, func: Callable, *args, **kwargs):
+        # 打ち切られた処理も、終わった時点の所要時間を記録する
+        with metrics["stage_seconds"].time(stage=name):
+            value = func(*args, **kwargs)
+        deliver(name, value)
+        return value
+
+    # ワーカースレッドからも st.error などが使えるようにコンテキスト（ジョブ内ではジョブ）を引き継ぐ
+    ctx = get_script_run_ctx(suppress_warning=True)
+    job = current_job()
+
+    def init_worker() -> None:
+        if ctx:
+            add_script_run_ctx(ctx=ctx)
+        bind_job(job)
+
+    executor = ThreadPoolExecutor(max_workers=len(tasks), initializer=init_worker)
+    try:
+        started_at = time.monotonic()
+        futures = {
+            name: executor.submit(timed, name, func, *args, timeout=timeouts[name])
+            for name, (func, args, _) in tasks.items()
+        }
+
+        results = {}
+        for name, future in futures.items():
+            # API 呼び出しのタイムアウトで戻るのを少しだけ待ち、それでも遅ければ打ち切る
+            remaining = timeouts[name] + FETCH_GRACE_SECONDS - (time.monotonic() - started_at)
+            try:
+                results[name] = future.result(timeout=max(0.0, remaining))
+            except FutureTimeoutError:
+                print(f"タイムアウトしました: {name}")
+                metrics["stage_fallbacks"].inc(stage=name, reason="timeout")
+                results[name] = tasks[name][2]()
+            except Exception as e:
+                print(f"エラーが発生しました: {name}: {str(e)}")
+                metrics["stage_fallbacks"].inc(stage=name, reason="error")
+                results[name] = tasks[name][2]()
+            deliver(name, results[name])
+    finally:
+        # 遅れている処理は待たずに結果を返す
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results["weather"], results["company_news"], results["industry_news"]
+
+###################
+# バックグラウンドの生成
+###################
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+    """生成ジョブのキュー（プロセス全体で共有し、スクリプトの再実行をまたいで結果を保持する）"""
+    settings = {**JOBS_DEFAULTS, **st.secrets.get("jobs", {})}
+    return JobQueue(
+        max_workers=int(settings["max_workers"]),
+        result_ttl=float(settings["result_ttl_seconds"]),
+        max_jobs=int(settings["max_jobs"])
+    )
+
+def report_error(message: str) -> None:
+    """エラーを表示する（ジョブのスレッドでは画面に出せないため、ジョブに記録してページで表示する）"""
+    job = current_job()
+    if job is not None:
+        job.add_error(message)
+    else:
+        st.error(message)
+
+def get_session_results() -> SessionResults:
+    """このセッションの生成結果"""
+    if "inoki_results" not in st.session_state:
+        st.session_state["inoki_results"] = SessionResults(SESSION_RESULTS_MAX)
+    return st.session_state["inoki_results"]
+
+def visit_job_key(
+    company_name: str,
+    prefecture: str,
+    city: str,
+    visit_date: date,
+    industry_category: str,
+    industry_detail: str
+) -> Tuple:
+    """生成ジョブのキー（入力の組）"""
+    return (company_name.strip(), prefecture, city, visit_date.isoformat(), industry_category, industry_detail)
+
+def run_visit_job(job: Job) -> Dict:
+    """送信1回分のデータ取得とメッセージ生成（ジョブのスレッドで実行）"""
+    company_name, prefecture, city, visit_date, industry_category, industry_detail = job.key
+    visit_date = date.fromisoformat(visit_date)
+    stage_seconds = get_metrics()["stage_seconds"]
+
+    # 送信1回あたりの待ち時間の予算（キューで順番を待った時間も含める）
+    queued_seconds = max(0.0, time.time() - job.submitted_at)
+    stage_seconds.observe(queued_seconds, stage="queued")
+    with stage_seconds.time(stage="submit"):
+        deadline_settings = get_deadline_settings()
+        deadline = Deadline(deadline_settings["total_seconds"], elapsed=queued_seconds)
+
+        # データ取得（天気とニュースを並行して取得）
+        job.update(stage="天気とニュースを取得中")
+        weather_info, company_news, industry_news = fetch_visit_data(
+            city, visit_date, company_name,
+            industry_category, industry_detail, deadline,
+            prefecture=prefecture,
+            on_result=job.publish
+        )
+
+        # アドバイス生成（生成途中の本文をジョブに記録）
+        job.update(stage="メッセージを生成中")
+        with stage_seconds.time(stage="llm"):
+            message = generate_inoki_message(
+                company_name, industry_category, industry_detail,
+                city, weather_info, company_news, industry_news,
+                on_chunk=lambda text: job.update(partial=text),
+                timeout=max(deadline.remaining(), deadline_settings["llm_min_seconds"])
+            )
+
+    return {
+        "message": message,
+        "weather_info": weather_info,
+        "company_news": company_news,
+        "industry_news": industry_news
+    }
 
 ###################
 # UI コンポーネント
 ###################
 
+@st.cache_resource
+def get_inoki_image() -> bytes:
+    """表示幅に縮小・圧縮した猪木画像（プロセスごとに一度だけ作成）
+
+    st.image は PNG を毎回 JPEG に変換し直すため、変換済みの JPEG を渡して
+    そのまま配信させる（内容が同じなので再実行・セッション間で同じ URL になる）
+    """
+    from PIL import Image
+
+    with Image.open(INOKI_IMAGE_PATH) as image:
+        image = image.convert("RGB")
+        if image.width > INOKI_IMAGE_WIDTH:
+            height = round(image.height * INOKI_IMAGE_WIDTH / image.width)
+            image = image.resize((INOKI_IMAGE_WIDTH, height), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=INOKI_IMAGE_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
 def location_selector(form_key=""):
     """場所選択のUI"""
     # キーの定義
@@ -583,10 +1722,172 @@ def display_weather_card(weather_info: dict, location: str):
             with st.expander("天気の詳細", expanded=False):
                 st.write(weather_info["description"])
 
+def render_message_card(message: str) -> str:
+    """猪木からのアドバイスのカードを生成"""
+    return f"""
+            <div class="message-card">
+                <h2 style="color: #FFD700; margin-bottom: 15px;">
+                    💬 猪木からのアドバイス
+                </h2>
+                <div style="background: rgba(255, 0, 0, 0.1); padding: 20px; border-radius: 8px;">
+                    <p style="color: white; font-size: 1.1em; line-height: 1.6;">
+                        {message}
+                    </p>
+                </div>
+            </div>
+            """
+
 ###################
 # メイン処理
 ###################
 
+def follow_visit_job(job: Job) -> Optional[Dict]:
+    """ジョブが終わるまで、届いた順に天気・ニュース・生成途中の本文を表示し、結果を返す（失敗した場合は None）
+
+    データが揃って生成を待つ間は定型のメッセージを表示し、生成した本文が届いたら置き換える
+    """
+    company_name, _, city, _, industry_category, industry_detail = job.key
+    with st.spinner("🔥 闘魂注入中..."):
+        stage_placeholder = st.empty()
+        message_placeholder = st.empty()
+        weather_placeholder = st.empty()
+        news_placeholder = st.empty()
+
+        version, state = job.snapshot()
+        shown: Dict[str, object] = {}
+        while True:
+            stage = "順番待ち" if state["status"] == QUEUED else state["stage"]
+            if stage != shown.get("stage"):
+                shown["stage"] = stage
+                stage_placeholder.caption(stage)
+
+            parts = state["parts"]
+            weather_info = parts.get("weather")
+            if weather_info is not None and weather_info is not shown.get("weather"):
+                shown["weather"] = weather_info
+                with weather_placeholder.container():
+                    render_weather_section(weather_info)
+
+            news = (parts.get("company_news"), parts.get("industry_news"))
+            if news != (None, None) and news != shown.get("news"):
+                shown["news"] = news
+                with news_placeholder.container():
+                    render_news_section(company_name, industry_category, industry_detail, *news)
+
+            if state["partial"]:
+                message = state["partial"]
+            elif weather_info is not None and None not in news:
+                # 生成が遅い間は定型のメッセージを出しておく
+                message = fallback_inoki_message(city, industry_category, industry_detail, weather_info)
+            else:
+                message = None
+            if message is not None and message != shown.get("message"):
+                shown["message"] = message
+                message_placeholder.markdown(render_message_card(message), unsafe_allow_html=True)
+
+            if state["finished_at"] is not None:
+                break
+            version = job.wait(version, timeout=STREAM_RENDER_INTERVAL)
+            _, state = job.snapshot()
+    stage_placeholder.empty()
+
+    for error in state["errors"]:
+        st.error(error)
+    if state["status"] != DONE:
+        st.error(f"生成に失敗しました: {state['error']}")
+        return None
+
+    # 最終的な結果で置き換える（メッセージは途中で失敗した場合のフォールバックを含む）
+    result = state["result"]
+    message_placeholder.markdown(render_message_card(result["message"]), unsafe_allow_html=True)
+    if result["weather_info"] is not shown.get("weather"):
+        with weather_placeholder.container():
+            render_weather_section(result["weather_info"])
+    if (result["company_news"], result["industry_news"]) != shown.get("news"):
+        with news_placeholder.container():
+            render_news_section(
+                company_name, industry_category, industry_detail,
+                result["company_news"], result["industry_news"]
+            )
+    return result
+
+def render_visit_result(result: Dict, job_key: Tuple) -> None:
+    """生成結果（メッセージ・天気・ニュース）の表示"""
+    company_name, _, _, _, industry_category, industry_detail = job_key
+    st.markdown(render_message_card(result["message"]), unsafe_allow_html=True)
+    render_weather_section(result["weather_info"])
+    render_news_section(
+        company_name, industry_category, industry_detail,
+        result["company_news"], result["industry_news"]
+    )
+
+def render_weather_section(weather_info: Dict) -> None:
+    """天気情報の表示"""
+    st.markdown("""
+    <div class="message-card">
+        <h3 style="color: white;">🌤️ 天気情報</h3>
+    """, unsafe_allow_html=True)
+    
+    cols = st.columns(2)
+    with cols[0]:
+        st.metric("天気", weather_info.get('telop', '不明'))
+    with cols[1]:
+        st.metric("気温", weather_info.get('temperature_text', '').replace('気温:', ''))
+
+    if weather_info.get("description"):
+        with st.expander("天気の詳細", expanded=False):
+            # 改行を事前に処理してからf-stringで使用
+            description_html = weather_info["description"].replace('\n', '<br>')
+            st.markdown(f"""
+            <div style="color: white;">
+                {description_html}
+            </div>
+            """, unsafe_allow_html=True)
+    
+    st.markdown("</div>", unsafe_allow_html=True)
+
+def render_news_list(news_list: Optional[List[Dict]], empty_text: str) -> None:
+    """ニュースの一覧（None は取得中）"""
+    if news_list is None:
+        st.caption("取得中...")
+        return
+    if not news_list:
+        st.info(empty_text)
+        return
+    for news in news_list:
+        st.markdown(f"""
+        <div class="news-content" style="background: rgba(0,0,0,0.2); 
+             padding: 15px; border-radius: 8px; margin-bottom: 10px;">
+            <h4 style="color: white; margin: 0;">{news['title']}</h4>
+            <p style="color: white; opacity: 0.9;">{news['description']}</p>
+            <small style="color: white; opacity: 0.7;">
+                関連度: {news['relevance_score']:.1f} | 
+                {datetime.strptime(news['published_at'][:10], '%Y-%m-%d').strftime('%Y年%m月%d日')}
+            </small>
+        </div>
+        """, unsafe_allow_html=True)
+
+def render_news_section(
+    company_name: str,
+    industry_category: str,
+    industry_detail: str,
+    company_news: Optional[List[Dict]],
+    industry_news: Optional[List[Dict]]
+) -> None:
+    """関連ニュースの表示（取得中のタブは None）"""
+    st.markdown("""
+    <div class="message-card">
+        <h3 style="color: white;">📰 関連ニュース</h3>
+    """, unsafe_allow_html=True)
+    
+    tabs = st.tabs(["🏢 企業ニュース", "📈 業界ニュース"])
+    with tabs[0]:
+        render_news_list(company_news, f"{company_name}に関する最新ニュースは見つかりませんでした")
+    with tabs[1]:
+        render_news_list(industry_news, f"{industry_category}（{industry_detail}）の最新ニュースは見つかりませんでした")
+    
+    st.markdown("</div>", unsafe_allow_html=True)
+
 def main():
     st.set_page_config(
         page_title="🔥 燃える闘魂アイスブレイク",
@@ -594,6 +1895,10 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+
+    # 天気予報と業界ニュースの事前取得、計測値の書き出しを開始（初回のみ）
+    start_prefetch_scheduler()
+    start_metrics_exporter()
     
     # スタイルの適用
     st.markdown("""
@@ -686,7 +1991,7 @@ def main():
     # 画像を中央寄せで表示
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        st.image("inoki.png")
+        st.image(get_inoki_image())
 
     # サイドバー
     with st.sidebar:
@@ -714,103 +2019,43 @@ def main():
             with cols[1]:
                 submit = st.form_submit_button("生成 ✨")
 
-    if submit and company_name:
-        with st.spinner("🔥 闘魂注入中..."):
-            # データ取得
-            weather_info = get_weather_info(city, visit_date)
-            company_news = get_company_news(company_name)
-            industry_news = get_industry_news(industry_category, industry_detail)
-
-            # アドバイス生成
-            message = generate_inoki_message(
-                company_name, industry_category, industry_detail,
-                city, weather_info, company_news, industry_news
-            )
-
-            # メッセージ表示
-            st.markdown(f"""
-            <div class="message-card">
-                <h2 style="color: #FFD700; margin-bottom: 15px;">
-                    💬 猪木からのアドバイス
-                </h2>
-                <div style="background: rgba(255, 0, 0, 0.1); padding: 20px; border-radius: 8px;">
-                    <p style="color: white; font-size: 1.1em; line-height: 1.6;">
-                        {message}
-                    </p>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-
-            # 天気情報
-            st.markdown("""
-            <div class="message-card">
-                <h3 style="color: white;">🌤️ 天気情報</h3>
-            """, unsafe_allow_html=True)
-            
-            cols = st.columns(2)
-            with cols[0]:
-                st.metric("天気", weather_info.get('telop', '不明'))
-            with cols[1]:
-                st.metric("気温", weather_info.get('temperature_text', '').replace('気温:', ''))
-
-            if weather_info.get("description"):
-                with st.expander("天気の詳細", expanded=False):
-                    # 改行を事前に処理してからf-stringで使用
-                    description_html = weather_info["description"].replace('\n', '<br>')
-                    st.markdown(f"""
-                    <div style="color: white;">
-                        {description_html}
-                    </div>
-                    """, unsafe_allow_html=True)
-            
-            st.markdown("</div>", unsafe_allow_html=True)
-
-            # ニュース表示
-            st.markdown("""
-            <div class="message-card">
-                <h3 style="color: white;">📰 関連ニュース</h3>
-            """, unsafe_allow_html=True)
-            
-            tabs = st.tabs(["🏢 企業ニュース", "📈 業界ニュース"])
-            
-            with tabs[0]:
-                if company_news:
-                    for news in company_news:
-                        st.markdown(f"""
-                        <div class="news-content" style="background: rgba(0,0,0,0.2); 
-                             padding: 15px; border-radius: 8px; margin-bottom: 10px;">
-                            <h4 style="color: white; margin: 0;">{news['title']}</h4>
-                            <p style="color: white; opacity: 0.9;">{news['description']}</p>
-                            <small style="color: white; opacity: 0.7;">
-                                関連度: {news['relevance_score']:.1f} | 
-                                {datetime.strptime(news['published_at'][:10], '%Y-%m-%d').strftime('%Y年%m月%d日')}
-                            </small>
-                        </div>
-                        """, unsafe_allow_html=True)
-                else:
-                    st.info(f"{company_name}に関する最新ニュースは見つかりませんでした")
-
-            with tabs[1]:
-                if industry_news:
-                    for news in industry_news:
-                        st.markdown(f"""
-                        <div class="news-content" style="background: rgba(0,0,0,0.2); 
-                             padding: 15px; border-radius: 8px; margin-bottom: 10px;">
-                            <h4 style="color: white; margin: 0;">{news['title']}</h4>
-                            <p style="color: white; opacity: 0.9;">{news['description']}</p>
-                            <small style="color: white; opacity: 0.7;">
-                                関連度: {news['relevance_score']:.1f} | 
-                                {datetime.strptime(news['published_at'][:10], '%Y-%m-%d').strftime('%Y年%m月%d日')}
-                            </small>
-                        </div>
-                        """, unsafe_allow_html=True)
-                else:
-                    st.info(f"{industry_category}（{industry_detail}）の最新ニュースは見つかりませんでした")
-            
-            st.markdown("</div>", unsafe_allow_html=True)
+    results = get_session_results()
+    if clear:
+        results.clear()
+        st.session_state.pop("inoki_job_key", None)
 
+    if submit and company_name:
+        job_key = visit_job_key(
+            company_name, prefecture, city, visit_date, industry_category, industry_detail
+        )
+        # 入力が変わっていなければこのセッションの結果をそのまま表示する
+        if results.get(job_key) is None:
+            # 同じ入力のジョブが実行中・完了済みならそれに合流する
+            _, started = get_job_queue().submit(job_key, run_visit_job)
+            get_metrics()["job_submits"].inc(result="started" if started else "attached")
+            st.session_state["inoki_job_key"] = job_key
+        else:
+            get_metrics()["job_submits"].inc(result="session")
     elif submit:
         st.warning("会社名を入力してください")
 
+    # 実行中のジョブ（再実行の前に送信したものを含む）の進み具合と結果を表示する
+    job_key = st.session_state.get("inoki_job_key")
+    job = get_job_queue().get(job_key) if job_key else None
+    if job_key and job is None:
+        # 結果の保持期間を過ぎたジョブ
+        del st.session_state["inoki_job_key"]
+    if job is not None:
+        result = follow_visit_job(job)
+        # 表示し終えたジョブはこのセッションから外し、結果を保持する
+        del st.session_state["inoki_job_key"]
+        if result is not None:
+            results.put(job_key, result)
+    else:
+        # 再実行時は最後の結果を取得し直さずに表示する
+        last = results.last()
+        if last is not None:
+            render_visit_result(last[1], last[0])
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
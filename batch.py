@@ -0,0 +1,186 @@
+"""訪問予定の一覧から猪木メッセージをまとめて生成するバッチ
+
+使い方:
+    python batch.py visits.csv -o greetings.csv
+    python batch.py visits.jsonl -o greetings.jsonl --concurrency 8
+
+入力は CSV（ヘッダー付き）または JSONL で、各行に以下の項目を持つ:
+    company_name, prefecture, city, industry_category, industry_detail, visit_date (YYYY-MM-DD)
+
+同じ予報区域の天気・同じ業種の業界ニュース・同じ会社のニュースは一度だけ取得する。
+API キーなどはアプリと同じ .streamlit/secrets.toml から読み込む。
+"""
+import argparse
+import csv
+import json
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from app import (
+    generate_inoki_message,
+    get_area_index,
+    get_company_news,
+    get_industry_news,
+    get_weather_info
+)
+from jobs import Job, bind_job, current_job
+
+# 入力の項目
+INPUT_FIELDS = [
+    "company_name", "prefecture", "city",
+    "industry_category", "industry_detail", "visit_date"
+]
+# 出力で追加する項目
+OUTPUT_FIELDS = [
+    "telop", "temperature_text", "company_news", "industry_news", "message", "error"
+]
+
+class SharedLookups:
+    """同じキーの取得を一度だけ実行し、結果をバッチ全体で共有する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures: Dict[Hashable, Future] = {}
+
+    def get(self, key: Hashable, func: Callable, *args):
+        with self._lock:
+            future = self._futures.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._futures[key] = future
+
+        # 最初に来た呼び出しだけが取得し、他は結果を待つ
+        if is_owner:
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+def collect_errors(func: Callable, *args) -> Tuple[object, List[str]]:
+    """func を実行し、結果と途中で報告されたエラーを返す
+
+    app の取得処理はエラーを report_error で画面に出して続けるが、bare モードでは
+    st.error が何も出さないため、ジョブとして実行してエラーを記録させる
+    """
+    job = Job(None)
+    previous = current_job()
+    bind_job(job)
+    try:
+        value = func(*args)
+    finally:
+        bind_job(previous)
+    return value, job.snapshot()[1]["errors"]
+
+def read_visits(path: str) -> List[Dict]:
+    """CSV または JSONL の訪問予定を読み込む"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+def write_results(path: str, results: List[Dict]) -> None:
+    """生成結果を CSV または JSONL で書き出す"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if path.endswith(".jsonl"):
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            return
+
+        writer = csv.DictWriter(f, fieldnames=INPUT_FIELDS + OUTPUT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for result in results:
+            writer.writerow({
+                **result,
+                "company_news": "\n".join(result["company_news"]),
+                "industry_news": "\n".join(result["industry_news"])
+            })
+
+def generate_visit(visit: Dict, lookups: SharedLookups) -> Dict:
+    """1件の訪問予定について天気・ニュースを取得しメッセージを生成"""
+    result = {field: visit.get(field, "") for field in INPUT_FIELDS}
+    result.update({field: "" for field in OUTPUT_FIELDS})
+    result["company_news"] = []
+    result["industry_news"] = []
+
+    try:
+        company_name = visit["company_name"].strip()
+        if not company_name:
+            raise ValueError("会社名がありません")
+        prefecture = visit.get("prefecture") or None
+        city = visit["city"]
+        industry_category = visit["industry_category"]
+        industry_detail = visit["industry_detail"]
+        visit_date = date.fromisoformat(str(visit["visit_date"]))
+
+        # 同じ予報区域・同じ日付の天気は共有する
+        area_key = get_area_index().resolve(city, prefecture) or city
+        # 取得できずに代わりの値（空のニュースなど）を使った場合もエラーとして残す
+        weather_info, weather_errors = lookups.get(
+            ("weather", area_key, visit_date),
+            collect_errors, get_weather_info, city, visit_date, prefecture
+        )
+        company_news, company_errors = lookups.get(
+            ("company", company_name), collect_errors, get_company_news, company_name
+        )
+        industry_news, industry_errors = lookups.get(
+            ("industry", industry_category, industry_detail),
+            collect_errors, get_industry_news, industry_category, industry_detail
+        )
+
+        message, message_errors = collect_errors(
+            generate_inoki_message,
+            company_name, industry_category, industry_detail,
+            city, weather_info, company_news, industry_news
+        )
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+
+    result.update({
+        "telop": weather_info["telop"],
+        "temperature_text": weather_info["temperature_text"],
+        "company_news": [news["title"] for news in company_news],
+        "industry_news": [news["title"] for news in industry_news],
+        "message": message.strip(),
+        "error": " / ".join(weather_errors + company_errors + industry_errors + message_errors)
+    })
+    return result
+
+def run_batch(visits: List[Dict], concurrency: int) -> Iterator[Dict]:
+    """同時実行数を制限して訪問予定を処理する（入力順に結果を返す）"""
+    lookups = SharedLookups()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        yield from executor.map(lambda visit: generate_visit(visit, lookups), visits)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="猪木メッセージのバッチ生成")
+    parser.add_argument("input", help="訪問予定（.csv または .jsonl）")
+    parser.add_argument("-o", "--output", required=True, help="出力先（.csv または .jsonl）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に処理する件数")
+    args = parser.parse_args(argv)
+
+    visits = read_visits(args.input)
+    started_at = time.monotonic()
+
+    results = []
+    for i, result in enumerate(run_batch(visits, max(1, args.concurrency)), start=1):
+        results.append(result)
+        status = f"エラー: {result['error']}" if result["error"] else "完了"
+        print(f"[{i}/{len(visits)}] {result['company_name']} {status}", file=sys.stderr)
+
+    write_results(args.output, results)
+    failed = sum(1 for result in results if result["error"])
+    print(
+        f"{len(results)}件を処理しました（失敗 {failed}件、{time.monotonic() - started_at:.1f}秒）",
+        file=sys.stderr
+    )
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
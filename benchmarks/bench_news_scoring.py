@@ -0,0 +1,196 @@
+"""ニュース評価のマイクロベンチマーク
+
+従来の記事ごとのループ（検索語の部分一致で加点）と news_scoring の文字 n-gram TF-IDF の
+評価を同じ記事群で比較する。どちらもアプリと同じく、重複を除いた上位 RESULT_LIMIT 件を求める。
+idf はアプリが索引から作るのと同様に、評価する記事群とは別のコーパス（IDF_CORPUS_SIZE 件）から
+一度だけ作る。評価の仕方が異なるため、結果は一致を確認するのではなく、しきい値を超えた記事と
+上位の記事の重なりを表示する。
+
+使い方:
+    python -m benchmarks.bench_news_scoring
+    python -m benchmarks.bench_news_scoring --articles recorded.jsonl --repeat 20
+    python -m benchmarks.bench_news_scoring --count 50 200 1000 5000
+
+--articles には NewsAPI の記事（1行1件の JSONL）または NewsAPI のレスポンス JSON を渡す。
+省略した場合は --count の件数ごとに記事を合成する。
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from news_dedup import dedupe_articles
+from news_scoring import NgramIdf, score_company_articles, score_industry_articles
+
+COMPANY_NAME = "トヨタ"
+SEARCH_TERMS = ["製造", "メーカー", "工場", "自動車", "車", "EV", "電気自動車"]
+# 使う記事数（app の NEWS_TARGET_ARTICLES）
+RESULT_LIMIT = 3
+# idf を求めるコーパスの記事数（評価する記事群とは別に合成する）
+IDF_CORPUS_SIZE = 5000
+
+WORDS = [
+    "トヨタ", "自動車", "電気自動車", "EV", "工場", "メーカー", "新型", "決算", "発表",
+    "増産", "製造", "市場", "投資", "技術", "まとめ", "速報", "提携", "海外", "販売"
+]
+DOMAINS = [
+    "https://www.nikkei.com/article/", "https://jp.reuters.com/", "https://www.itmedia.co.jp/news/",
+    "https://example.jp/", "https://news.example.com/", "https://www.businessinsider.jp/post-"
+]
+
+def legacy_company(articles: List[Dict], company_name: str, limit: Optional[int] = RESULT_LIMIT) -> List[Dict]:
+    """従来の企業ニュース評価（上位の重複を除く）"""
+    ng_words = ["ちょいブス", "エ□", "まとめ", "2ch", "アフィリエイト", "まとめサイト", "速報"]
+    scored_articles = []
+    for article in articles:
+        title_lower = article["title"].lower()
+        desc_lower = article["description"].lower() if article["description"] else ""
+        company_lower = company_name.lower()
+        if any(ng_word.lower() in title_lower for ng_word in ng_words):
+            continue
+        score = 0
+        if company_lower in title_lower:
+            score += 5
+        if company_lower in desc_lower:
+            score += 3
+        days_old = (datetime.now() - datetime.strptime(article["publishedAt"][:10], "%Y-%m-%d")).days
+        score += max(0, 2 - (days_old * 0.1))
+        domain = article["url"].lower()
+        if any(d in domain for d in ["nikkei.com", "reuters.com", "bloomberg.", "nhk.or.jp"]):
+            score *= 1.5
+        elif any(d in domain for d in ["itmedia.co.jp", "techcrunch.com", "businessinsider.jp"]):
+            score *= 1.3
+        if score >= 3:
+            scored_articles.append({
+                "title": article["title"],
+                "description": article["description"],
+                "url": article["url"],
+                "published_at": article["publishedAt"],
+                "relevance_score": score
+            })
+    return dedupe_articles(sorted(scored_articles, key=lambda x: x["relevance_score"], reverse=True), limit=limit)
+
+def legacy_industry(articles: List[Dict], search_terms: List[str], limit: Optional[int] = RESULT_LIMIT) -> List[Dict]:
+    """従来の業界ニュース評価（上位の重複を除く）"""
+    ng_words = ["ちょいブス", "エ□", "まとめ", "2ch", "アフィリエイト", "まとめサイト", "速報"]
+    scored_articles = []
+    for article in articles:
+        title_lower = article["title"].lower()
+        desc_lower = article["description"].lower() if article["description"] else ""
+        if any(ng_word.lower() in title_lower for ng_word in ng_words):
+            continue
+        score = 0
+        for term in search_terms:
+            if term.lower() in title_lower:
+                score += 2
+            if term.lower() in desc_lower:
+                score += 1
+        domain = article["url"].lower()
+        if any(d in domain for d in ["nikkei.com", "reuters.com", "bloomberg.", "nhk.or.jp"]):
+            score *= 1.5
+        elif any(d in domain for d in ["itmedia.co.jp", "techcrunch.com", "businessinsider.jp"]):
+            score *= 1.3
+        days_old = (datetime.now() - datetime.strptime(article["publishedAt"][:10], "%Y-%m-%d")).days
+        score += max(0, 2 - (days_old * 0.1))
+        if score >= 2:
+            scored_articles.append({
+                "title": article["title"],
+                "description": article["description"],
+                "url": article["url"],
+                "published_at": article["publishedAt"],
+                "relevance_score": score
+            })
+    return dedupe_articles(sorted(scored_articles, key=lambda x: x["relevance_score"], reverse=True), limit=limit)
+
+def synthesize_articles(count: int, seed: int = 0) -> List[Dict]:
+    """記録済みの記事がない場合に NewsAPI 形式の記事を合成する"""
+    rng = random.Random(seed)
+    today = datetime.now()
+    articles = []
+    for i in range(count):
+        title = "".join(rng.choices(WORDS, k=rng.randint(4, 10)))
+        description = "、".join(rng.choices(WORDS, k=rng.randint(8, 30))) if rng.random() > 0.1 else None
+        published_at = today - timedelta(days=rng.randint(0, 30))
+        articles.append({
+            "title": title,
+            "description": description,
+            "url": f"{rng.choice(DOMAINS)}{i}",
+            "publishedAt": published_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+        })
+    return articles
+
+def load_articles(path: str) -> List[Dict]:
+    """記録済みの記事を読み込む"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("{") and '"articles"' in text.split("\n", 1)[0]:
+        return json.loads(text)["articles"]
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def measure(func: Callable[[], List[Dict]], repeat: int) -> float:
+    """最良の実行時間（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ニュース評価のベンチマーク")
+    parser.add_argument("--articles", help="記録済みの記事（JSONL または NewsAPI のレスポンス）")
+    parser.add_argument("--count", type=int, nargs="+", default=[5000], help="合成する記事数（複数指定で件数ごとに計測）")
+    parser.add_argument("--repeat", type=int, default=10, help="計測の繰り返し回数")
+    args = parser.parse_args()
+
+    if args.articles:
+        pools = [load_articles(args.articles)]
+    else:
+        pools = [synthesize_articles(count) for count in args.count]
+
+    corpus = [
+        article["title"] + " " + (article["description"] or "")
+        for article in synthesize_articles(IDF_CORPUS_SIZE, seed=1)
+    ]
+    started_at = time.perf_counter()
+    idf = NgramIdf(corpus)
+    print(f"idf の作成: {len(corpus)}件 {(time.perf_counter() - started_at) * 1000:.1f}ms")
+
+    for articles in pools:
+        benchmark(articles, idf, args.repeat)
+
+def overlap(left: List[Dict], right: List[Dict]) -> str:
+    """2つの結果に共通する記事の数"""
+    left_urls = {article["url"] for article in left}
+    right_urls = {article["url"] for article in right}
+    return f"{len(left_urls & right_urls)}/{max(len(left_urls), len(right_urls))}"
+
+def benchmark(articles: List[Dict], idf: NgramIdf, repeat: int) -> None:
+    """記事群について従来の評価と TF-IDF の評価を比べる"""
+    cases = [
+        ("企業ニュース",
+         lambda limit: legacy_company(articles, COMPANY_NAME, limit),
+         lambda limit: score_company_articles(articles, COMPANY_NAME, limit=limit, idf=idf)),
+        ("業界ニュース",
+         lambda limit: legacy_industry(articles, SEARCH_TERMS, limit),
+         lambda limit: score_industry_articles(articles, SEARCH_TERMS, limit=limit, idf=idf))
+    ]
+
+    print(f"記事数: {len(articles)}")
+    for name, legacy, tfidf in cases:
+        legacy_time = measure(lambda: legacy(RESULT_LIMIT), repeat)
+        tfidf_time = measure(lambda: tfidf(RESULT_LIMIT), repeat)
+        print(
+            f"{name}: 従来 {legacy_time * 1000:.2f}ms "
+            f"({legacy_time / len(articles) * 1e6:.1f}µs/件) / "
+            f"TF-IDF {tfidf_time * 1000:.2f}ms "
+            f"({tfidf_time / len(articles) * 1e6:.1f}µs/件) "
+            f"x{legacy_time / tfidf_time:.2f} / "
+            f"しきい値以上の一致 {overlap(legacy(None), tfidf(None))} / "
+            f"上位{RESULT_LIMIT}件の一致 {overlap(legacy(RESULT_LIMIT), tfidf(RESULT_LIMIT))}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""同時セッション数を増やしながら app を操作する負荷テスト
+
+app.py を `streamlit run` で起動し、ブラウザと同じ WebSocket（/_stcore/stream）で
+複数のセッションを同時に接続する。各セッションはサイドバーで都道府県・市区町村
+（location_selector）と業種（industry_selector）を選び、会社名を入力してフォームを送信する。
+外部APIは benchmarks.stubs のスタブを使い、事前取得は secrets で無効にする。
+
+段階ごとに、送信の所要時間（スクリプトの再実行が終わるまで）と、
+サーバープロセスの CPU 使用率・メモリを表示する。
+
+使い方（リポジトリのルートで実行。サーバーの CPU・メモリの計測は Linux のみ）:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --ramp 1 2 4 8 16 32 --sessions 4 --latency 0.3
+    python -m benchmarks.load_test --cache warm --max-p95 10 --json load.json
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from websockets.sync.client import connect
+
+from benchmarks.run import COMPANY_NAMES, bench_secrets, percentile, write_secrets
+from benchmarks.stubs import StubServers, add_behavior_arguments, behaviors_from_args
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# 操作するウィジェットのラベル（app.py の表示と合わせる）
+PREFECTURE_LABEL = "都道府県 🗾"
+CITY_LABEL = "市区町村 📍"
+CATEGORY_LABEL = "業種カテゴリー 🏭"
+DETAIL_LABEL = "詳細業種 🔍"
+COMPANY_LABEL = "会社名 🏢"
+SUBMIT_LABEL = "生成 ✨"
+
+WIDGET_TYPES = ("selectbox", "text_input", "date_input", "button")
+
+###################
+# サーバー
+###################
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(secrets_path: Path, port: int, timeout: float = 60.0) -> subprocess.Popen:
+    """app.py を起動し、ヘルスチェックが通るまで待つ"""
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "streamlit", "run", "app.py",
+            "--server.headless", "true",
+            "--server.port", str(port),
+            "--server.address", "127.0.0.1",
+            "--server.fileWatcherType", "none",
+            "--browser.gatherUsageStats", "false",
+            "--secrets.files", str(secrets_path)
+        ],
+        cwd=REPO_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("サーバーが起動できませんでした")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("サーバーの起動がタイムアウトしました")
+
+class ProcessUsage:
+    """/proc から読むプロセスの CPU 時間とメモリ（Linux 以外では None）"""
+
+    def __init__(self, pid: int):
+        self._pid = pid
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self._pid}/stat") as f:
+                # コマンド名に空白が含まれても崩れないよう、括弧の後ろから数える
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_mib(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self._pid}/statm") as f:
+                pages = int(f.read().split()[1])
+        except OSError:
+            return None
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+###################
+# セッション
+###################
+
+class BrowserSession:
+    """ブラウザの代わりに WebSocket でスクリプトの再実行を要求するセッション"""
+
+    def __init__(self, url: str, timeout: float):
+        self._url = url
+        self._timeout = timeout
+        self._connection = None
+        self._websocket = None
+        # ラベルごとのウィジェット（要素の種類, 要素）と現在の値
+        self.widgets: Dict[str, Tuple[str, object]] = {}
+        self.values: Dict[str, WidgetState] = {}
+        self.errors = 0
+
+    def __enter__(self) -> "BrowserSession":
+        self._connection = connect(self._url, max_size=None, open_timeout=self._timeout)
+        self._websocket = self._connection.__enter__()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._connection.__exit__(*exc)
+
+    def select(self, label: str, option: str) -> None:
+        _, element = self.widgets[label]
+        self.values[label] = WidgetState(id=element.id, string_value=option)
+
+    def options(self, label: str) -> List[str]:
+        _, element = self.widgets[label]
+        return list(element.options)
+
+    def input_text(self, label: str, text: str) -> None:
+        _, element = self.widgets[label]
+        self.values[label] = WidgetState(id=element.id, string_value=text)
+
+    def run(self, click: Optional[str] = None) -> float:
+        """現在の値（と押したボタン）で再実行し、終わるまでの秒数を返す"""
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        states = [state for label, state in self.values.items() if label in self.widgets]
+        if click is not None:
+            _, button = self.widgets[click]
+            states.append(WidgetState(id=button.id, trigger_value=True))
+        message.rerun_script.widget_states.widgets.extend(states)
+
+        started_at = time.perf_counter()
+        self._websocket.send(message.SerializeToString())
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(self._websocket.recv(timeout=self._timeout))
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                self._on_element(forward.delta.new_element)
+            elif kind == "script_finished":
+                return time.perf_counter() - started_at
+
+    def _on_element(self, element) -> None:
+        kind = element.WhichOneof("type")
+        if kind == "exception" or (kind == "alert" and element.alert.format == Alert.ERROR):
+            self.errors += 1
+            return
+        if kind not in WIDGET_TYPES:
+            return
+
+        widget = getattr(element, kind)
+        self.widgets[widget.label] = (kind, widget)
+        state = self.values.get(widget.label)
+        if kind == "selectbox":
+            # 初回や、コールバックで値や選択肢が変わった場合はサーバーの値に合わせる
+            if widget.set_value:
+                value = widget.raw_value
+            elif state is not None and state.string_value in widget.options:
+                value = state.string_value
+            else:
+                value = widget.options[widget.default] if widget.options else ""
+            self.values[widget.label] = WidgetState(id=widget.id, string_value=value)
+        elif kind == "text_input" and state is None:
+            self.values[widget.label] = WidgetState(id=widget.id, string_value=widget.default)
+        elif kind == "date_input" and state is None:
+            state = WidgetState(id=widget.id)
+            state.string_array_value.data[:] = list(widget.default)
+            self.values[widget.label] = state
+        elif state is not None:
+            state.id = widget.id
+
+def run_session(url: str, seed: int, timeout: float) -> Dict:
+    """1セッション分の操作（ページ表示 → 地域・業種の選択 → 送信）"""
+    rng = random.Random(seed)
+    with BrowserSession(url, timeout) as session:
+        page_seconds = session.run()
+
+        # 都道府県・業種カテゴリーを変えると市区町村・詳細業種がコールバックで切り替わる
+        session.select(PREFECTURE_LABEL, rng.choice(session.options(PREFECTURE_LABEL)))
+        session.run()
+        session.select(CITY_LABEL, rng.choice(session.options(CITY_LABEL)))
+        session.select(CATEGORY_LABEL, rng.choice(session.options(CATEGORY_LABEL)))
+        session.run()
+        session.select(DETAIL_LABEL, rng.choice(session.options(DETAIL_LABEL)))
+        session.input_text(COMPANY_LABEL, rng.choice(COMPANY_NAMES))
+
+        submit_seconds = session.run(click=SUBMIT_LABEL)
+        return {"page_seconds": page_seconds, "submit_seconds": submit_seconds, "errors": session.errors}
+
+###################
+# 段階ごとの実行
+###################
+
+def run_step(url: str, usage: ProcessUsage, concurrency: int, sessions: int, timeout: float, seed: int) -> Dict:
+    """concurrency 個のセッションを同時に動かし、それぞれ sessions 回ずつ操作する"""
+    results: List[Dict] = []
+    failures = 0
+    rss_before = usage.rss_mib()
+    peak_rss = rss_before or 0.0
+    stop_sampling = threading.Event()
+
+    def sample_memory() -> None:
+        nonlocal peak_rss
+        while not stop_sampling.wait(0.2):
+            peak_rss = max(peak_rss, usage.rss_mib() or 0.0)
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    cpu_before = usage.cpu_seconds()
+    started_at = time.perf_counter()
+
+    total = concurrency * sessions
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_session, url, seed + i, timeout) for i in range(total)]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                failures += 1
+                print(f"セッションが失敗しました: {type(e).__name__}: {str(e)}")
+
+    wall = time.perf_counter() - started_at
+    cpu_after = usage.cpu_seconds()
+    stop_sampling.set()
+    sampler.join()
+
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    submits = sorted(result["submit_seconds"] for result in results)
+    pages = sorted(result["page_seconds"] for result in results)
+    return {
+        "concurrency": concurrency,
+        "sessions": total,
+        "failures": failures,
+        "errors": sum(result["errors"] for result in results),
+        "page_p50_s": percentile(pages, 50),
+        "submit_p50_s": percentile(submits, 50),
+        "submit_p95_s": percentile(submits, 95),
+        "submit_p99_s": percentile(submits, 99),
+        "throughput_per_s": len(results) / wall if wall > 0 else float("nan"),
+        "server_cpu_percent": cpu / wall * 100 if cpu is not None and wall > 0 else None,
+        "server_cpu_seconds_per_session": cpu / total if cpu is not None else None,
+        "server_peak_rss_mib": peak_rss or None,
+        # 同時に接続しているセッション1つあたりの増加分
+        "server_rss_mib_per_concurrent_session": (
+            (peak_rss - rss_before) / concurrency if rss_before is not None else None
+        )
+    }
+
+def format_optional(value: Optional[float], spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+def print_step(result: Dict) -> None:
+    print(
+        f"{result['concurrency']:>4} {result['sessions']:>6} "
+        f"{result['page_p50_s']:>8.2f} {result['submit_p50_s']:>8.2f} "
+        f"{result['submit_p95_s']:>8.2f} {result['submit_p99_s']:>8.2f} "
+        f"{result['throughput_per_s']:>7.2f} "
+        f"{format_optional(result['server_cpu_percent'], '.0f'):>6} "
+        f"{format_optional(result['server_cpu_seconds_per_session'], '.3f'):>8} "
+        f"{format_optional(result['server_peak_rss_mib'], '.0f'):>8} "
+        f"{format_optional(result['server_rss_mib_per_concurrent_session'], '.2f'):>8} "
+        f"{result['errors'] + result['failures']:>4}",
+        flush=True
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="同時セッション数を増やしながら app を操作する負荷テスト")
+    parser.add_argument("--ramp", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="同時セッション数の段階")
+    parser.add_argument("--sessions", type=int, default=3, help="段階ごとに1つの同時セッション枠で行う操作の回数")
+    parser.add_argument("--cache", choices=["cold", "warm"], default="cold")
+    parser.add_argument("--timeout", type=float, default=120.0, help="1回の再実行を待つ上限（秒）")
+    parser.add_argument("--max-p95", type=float, help="送信の p95（秒）がこれを超えたら以降の段階を打ち切る")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="結果を書き出す JSON ファイル")
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    results = []
+    with StubServers(**behaviors_from_args(args)) as stubs, tempfile.TemporaryDirectory() as tmp:
+        secrets_path = Path(tmp) / "secrets.toml"
+        write_secrets(secrets_path, bench_secrets(stubs.endpoints(), args.cache, tmp))
+        port = free_port()
+        server = start_server(secrets_path, port)
+        try:
+            url = f"ws://127.0.0.1:{port}/_stcore/stream"
+            usage = ProcessUsage(server.pid)
+            # 初回のモジュール読み込みなどを計測に含めないよう、一度操作しておく
+            run_session(url, args.seed - 1, args.timeout)
+            print(f"{'並列':>4} {'操作数':>6} {'表示p50':>8} {'送信p50':>8} {'送信p95':>8} {'送信p99':>8} "
+                  f"{'件/秒':>7} {'CPU%':>6} {'CPU秒/件':>8} {'最大MiB':>8} {'MiB/並列':>8} {'失敗':>4}")
+            for step, concurrency in enumerate(args.ramp):
+                result = run_step(url, usage, concurrency, args.sessions, args.timeout, args.seed + step * 10000)
+                results.append(result)
+                print_step(result)
+                if args.max_p95 is not None and result["submit_p95_s"] > args.max_p95:
+                    print(f"送信の p95 が {args.max_p95} 秒を超えたため打ち切ります")
+                    break
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
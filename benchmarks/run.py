@@ -0,0 +1,201 @@
+"""外部APIのスタブを使ったオフラインのベンチマーク
+
+benchmarks.stubs のスタブサーバーを起動し、secrets の [endpoints] をスタブに向けた
+一時的な secrets.toml で app の関数を呼び出して、シナリオごとの
+レイテンシ（p50/p95/p99）とスループットを表示する。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.run
+    python -m benchmarks.run --scenarios submit --iterations 200 --concurrency 8 --latency 0.3
+    python -m benchmarks.run --cache warm --news-error-rate 0.1 --json result.json
+
+--cache cold はキャッシュとニュースの索引を使わずに毎回スタブに問い合わせ、warm は計測前に
+一度呼び出してキャッシュを温めておく。
+"""
+import argparse
+import json
+import math
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from streamlit import config
+from streamlit.logger import set_log_level
+
+from benchmarks.stubs import StubServers, add_behavior_arguments, behaviors_from_args
+
+COMPANY_NAMES = ["トヨタ", "ソニー", "任天堂", "日立", "パナソニック", "楽天", "ヤマト運輸", "三井住友銀行"]
+
+SCENARIOS = ["weather", "company_news", "industry_news", "message", "submit"]
+
+def bench_secrets(endpoints: Dict[str, str], cache: str, data_dir: str) -> Dict[str, Dict]:
+    """スタブに向けた secrets（事前取得と計測値のエンドポイントは無効にする）
+
+    ニュースの索引と呼び出し回数の制限の状態は data_dir に作る。索引は cold では使わず、
+    呼び出し回数は制限しない（サーキットブレーカーは有効）
+    """
+    secrets = {
+        "api_keys": {"openai_api": "sk-bench", "news_api": "bench"},
+        "endpoints": endpoints,
+        "prefetch": {"enabled": False},
+        "metrics": {"port": 0},
+        "cache": {"backend": "none"},
+        "news_index": {"enabled": cache == "warm", "path": str(Path(data_dir) / "news.sqlite3")},
+        "rate_limit": {
+            "path": str(Path(data_dir) / "ratelimit.sqlite3"),
+            "newsapi_rate_per_minute": 0, "newsapi_daily_limit": 0,
+            "weather_rate_per_minute": 0, "weather_daily_limit": 0
+        }
+    }
+    if cache == "cold":
+        # プロセス内の層にも残さない
+        secrets["cache"]["max_entries"] = 0
+    return secrets
+
+def write_secrets(path: Path, secrets: Dict[str, Dict]) -> None:
+    """secrets を secrets.toml として書き出す"""
+    lines = []
+    for section, values in secrets.items():
+        lines.append(f"[{section}]")
+        lines.extend(f"{key} = {json.dumps(value, ensure_ascii=False)}" for key, value in values.items())
+        lines.append("")
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近傍順位法によるパーセンタイル"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def build_scenarios() -> Dict[str, Callable[[int], object]]:
+    """シナリオ名と、i 回目の呼び出しを行う関数"""
+    # secrets の設定後に読み込む
+    import app
+    from jobs import Job
+
+    locations = [(prefecture, city) for prefecture, cities in app.LOCATIONS.items() for city in cities]
+    industries = [(category, detail) for category, details in app.INDUSTRIES.items() for detail in details]
+    visit_date = date.today()
+
+    def inputs(i: int):
+        category, detail = industries[i % len(industries)]
+        return locations[i % len(locations)], COMPANY_NAMES[i % len(COMPANY_NAMES)], category, detail
+
+    def weather(i: int):
+        (prefecture, city), _, _, _ = inputs(i)
+        return app.get_weather_info(city, visit_date, prefecture)
+
+    def company_news(i: int):
+        _, company_name, _, _ = inputs(i)
+        return app.get_company_news(company_name)
+
+    def industry_news(i: int):
+        _, _, category, detail = inputs(i)
+        return app.get_industry_news(category, detail)
+
+    def message(i: int):
+        (_, city), company_name, category, detail = inputs(i)
+        return app.generate_inoki_message(
+            company_name, category, detail, city, app.default_weather_info(), [], [],
+            on_chunk=lambda text: None
+        )
+
+    def submit(i: int):
+        # 送信1回分の生成ジョブ（キューを通さず、画面の表示を除く）
+        (prefecture, city), company_name, category, detail = inputs(i)
+        job_key = app.visit_job_key(company_name, prefecture, city, visit_date, category, detail)
+        return app.run_visit_job(Job(job_key))
+
+    return {
+        "weather": weather,
+        "company_news": company_news,
+        "industry_news": industry_news,
+        "message": message,
+        "submit": submit
+    }
+
+def run_scenario(call: Callable[[int], object], iterations: int, concurrency: int) -> Dict:
+    """iterations 回を concurrency 並列で呼び出し、レイテンシとスループットを返す"""
+    def timed(i: int) -> float:
+        started_at = time.perf_counter()
+        call(i)
+        return time.perf_counter() - started_at
+
+    errors = 0
+    latencies = []
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(timed, i) for i in range(iterations)]:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors += 1
+                print(f"エラーが発生しました: {str(e)}")
+    wall = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else float("nan")) * 1000,
+        "throughput_per_s": len(latencies) / wall if wall > 0 else float("nan")
+    }
+
+def print_report(results: Dict[str, Dict]) -> None:
+    print(f"{'シナリオ':<14} {'回数':>6} {'並列':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'件/秒':>8} {'例外':>4}")
+    for name, result in results.items():
+        print(
+            f"{name:<14} {result['iterations']:>6} {result['concurrency']:>4} "
+            f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+            f"{result['max_ms']:>9.1f} {result['throughput_per_s']:>8.1f} {result['errors']:>4}"
+        )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="スタブを使ったオフラインのベンチマーク")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--cache", choices=["cold", "warm"], default="cold")
+    parser.add_argument("--json", help="結果を書き出す JSON ファイル")
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    with StubServers(**behaviors_from_args(args)) as servers, tempfile.TemporaryDirectory() as tmp:
+        secrets_path = Path(tmp) / "secrets.toml"
+        write_secrets(secrets_path, bench_secrets(servers.endpoints(), args.cache, tmp))
+        config.set_option("secrets.files", [str(secrets_path)])
+        # 素の Python から st.* を呼ぶ際の警告を出さない
+        set_log_level("error")
+
+        scenarios = build_scenarios()
+        results = {}
+        for name in args.scenarios:
+            if args.cache == "warm":
+                # 同じ入力で一度呼び出してキャッシュを温める
+                run_scenario(scenarios[name], args.iterations, args.concurrency)
+            results[name] = run_scenario(scenarios[name], args.iterations, args.concurrency)
+
+        import app
+        print_report(results)
+        # エラー注入時にどこで代わりの値を使ったかを確認できるよう、外部APIの応答数も表示する
+        for line in app.get_metrics()["registry"].render().splitlines():
+            if line.startswith((
+                "inoki_upstream_responses_total", "inoki_upstream_retries_total", "inoki_stage_fallbacks_total",
+                "inoki_news_page_stops_total", "inoki_upstream_rejections_total", "inoki_upstream_circuit_open"
+            )):
+                print(line)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""ベンチマーク用の外部APIのスタブサーバー
+
+天気予報 API（weather.tsukumijima.net）、NewsAPI の /v2/everything、
+OpenAI の chat completions を、benchmarks/fixtures の記録済みレスポンスで返す。
+応答の遅延とエラーの割合は取得元ごとに指定できる。
+
+単体で起動する場合:
+    python -m benchmarks.stubs --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import parse_qs, quote, urlparse
+
+from timezones import JST
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+@dataclass
+class StubBehavior:
+    """応答の遅延（秒）とエラーの注入"""
+    latency: float = 0.0
+    # 遅延に加える 0〜jitter 秒のばらつき
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+
+    def apply(self) -> Optional[int]:
+        """遅延させ、エラーを返す場合はそのステータスコードを返す"""
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+def load_fixture(name: str) -> Dict:
+    with open(FIXTURES_DIR / name, encoding="utf-8") as f:
+        return json.load(f)
+
+class StubHandler(BaseHTTPRequestHandler):
+    """スタブ共通の応答処理"""
+    protocol_version = "HTTP/1.1"
+    behavior = StubBehavior()
+
+    def send_json(self, status: int, data: Dict) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def injected_error(self) -> bool:
+        status = self.behavior.apply()
+        if status is None:
+            return False
+        self.send_json(status, {"status": "error", "message": "injected error"})
+        return True
+
+    def log_message(self, format, *args):
+        # アクセスログは出さない
+        pass
+
+class WeatherHandler(StubHandler):
+    """天気予報 API（予報の日付と発表時刻は今日に合わせて返す）"""
+
+    def do_GET(self):
+        if not urlparse(self.path).path.startswith("/api/forecast/city/"):
+            self.send_json(404, {"error": "not found"})
+            return
+        if self.injected_error():
+            return
+
+        data = load_fixture("weather_forecast.json")
+        now = datetime.now(JST)
+        data["publicTime"] = now.replace(minute=0, second=0, microsecond=0).isoformat()
+        for days, forecast in enumerate(data["forecasts"]):
+            forecast["date"] = (date.today() + timedelta(days=days)).isoformat()
+        self.send_json(200, data)
+
+class NewsHandler(StubHandler):
+    """NewsAPI の記事検索
+
+    記事中の {q} は検索語の先頭に置き換え、公開日時は最新の記事が今日になるようずらす
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/v2/everything":
+            self.send_json(404, {"status": "error", "message": "not found"})
+            return
+        if self.injected_error():
+            return
+
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if not params.get("apiKey"):
+            self.send_json(401, {"status": "error", "code": "apiKeyMissing", "message": "apiKey がありません"})
+            return
+
+        term = re.split(r"\s+OR\s+", params.get("q", ""))[0].strip("\"() ")
+        page_size = int(params.get("pageSize", 100))
+        page = int(params.get("page", 1))
+
+        data = load_fixture("news_everything.json")
+        latest = max(datetime.fromisoformat(article["publishedAt"][:10]) for article in data["articles"])
+        shift = datetime.combine(date.today(), datetime.min.time()) - latest
+        articles = data["articles"][(page - 1) * page_size:page * page_size]
+        for article in articles:
+            if "{q}" in article["title"]:
+                # 検索語ごとに別の記事として扱われるよう URL も変える
+                article["url"] += f"-{quote(term)}"
+            for field in ("title", "description", "content"):
+                if article.get(field):
+                    article[field] = article[field].replace("{q}", term)
+            published_at = datetime.fromisoformat(article["publishedAt"].replace("Z", "+00:00"))
+            article["publishedAt"] = (published_at + shift).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.send_json(200, {"status": "ok", "totalResults": data["totalResults"], "articles": articles})
+
+class OpenAIHandler(StubHandler):
+    """OpenAI の chat completions（stream を指定すると SSE で少しずつ返す）"""
+
+    # ストリーミングで1チャンクあたりに返す文字数と間隔（秒）
+    chunk_chars = 8
+    chunk_interval = 0.02
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") not in ("/chat/completions", "/v1/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.injected_error():
+            return
+
+        data = load_fixture("chat_completion.json")
+        if not request.get("stream"):
+            self.send_json(200, data)
+            return
+
+        content = data["choices"][0]["message"]["content"]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send_event(payload: Dict) -> None:
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        base = {"id": data["id"], "object": "chat.completion.chunk", "created": data["created"], "model": data["model"]}
+        for i in range(0, len(content), self.chunk_chars):
+            send_event({**base, "choices": [
+                {"index": 0, "delta": {"content": content[i:i + self.chunk_chars]}, "finish_reason": None}
+            ]})
+            time.sleep(self.chunk_interval)
+        send_event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if request.get("stream_options", {}).get("include_usage"):
+            send_event({**base, "choices": [], "usage": data["usage"]})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+class StubServers:
+    """3つのスタブサーバーを空いているポートでバックグラウンドに起動する"""
+
+    def __init__(
+        self,
+        weather: Optional[StubBehavior] = None,
+        news: Optional[StubBehavior] = None,
+        openai: Optional[StubBehavior] = None,
+        host: str = "127.0.0.1"
+    ):
+        self._servers = {}
+        for name, handler, behavior in (
+            ("weather", WeatherHandler, weather),
+            ("news", NewsHandler, news),
+            ("openai", OpenAIHandler, openai)
+        ):
+            handler_class = type(handler.__name__, (handler,), {"behavior": behavior or StubBehavior()})
+            server = ThreadingHTTPServer((host, 0), handler_class)
+            server.daemon_threads = True
+            self._servers[name] = server
+
+    def start(self) -> "StubServers":
+        for name, server in self._servers.items():
+            threading.Thread(target=server.serve_forever, name=f"stub-{name}", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def endpoints(self) -> Dict[str, str]:
+        """app の secrets の [endpoints] に設定する接続先"""
+        urls = {name: f"http://{server.server_address[0]}:{server.server_address[1]}"
+                for name, server in self._servers.items()}
+        urls["openai"] += "/v1"
+        return urls
+
+    def __enter__(self) -> "StubServers":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+def add_behavior_arguments(parser: argparse.ArgumentParser) -> None:
+    """取得元ごとの遅延とエラーの引数を追加する（--latency などは全取得元の既定値）"""
+    parser.add_argument("--latency", type=float, default=0.05, help="応答の遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="遅延のばらつき（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="エラーを返す割合")
+    for name in ("weather", "news", "openai"):
+        parser.add_argument(f"--{name}-latency", type=float)
+        parser.add_argument(f"--{name}-error-rate", type=float)
+
+def behaviors_from_args(args: argparse.Namespace) -> Dict[str, StubBehavior]:
+    behaviors = {}
+    for name in ("weather", "news", "openai"):
+        latency = getattr(args, f"{name}_latency")
+        error_rate = getattr(args, f"{name}_error_rate")
+        behaviors[name] = StubBehavior(
+            latency=args.latency if latency is None else latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate if error_rate is None else error_rate
+        )
+    return behaviors
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="外部APIのスタブサーバーを起動する")
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    with StubServers(**behaviors_from_args(args)) as servers:
+        print("[endpoints]")
+        for name, url in servers.endpoints().items():
+            print(f'{name} = "{url}"')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""送信1回あたりの締め切りと、外部APIの呼び出しの時間配分"""
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+class Deadline:
+    """送信1回あたりの待ち時間の予算
+
+    elapsed は作成までに既に使った時間（秒、キューで順番を待った時間など）
+    """
+
+    def __init__(self, budget: float, elapsed: float = 0.0):
+        self.budget = budget
+        self._started_at = time.monotonic() - max(0.0, elapsed)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started_at
+
+    def remaining(self) -> float:
+        """残りの時間（秒）"""
+        return max(0.0, self.budget - self.elapsed())
+
+    def share(self, fraction: float) -> float:
+        """予算全体のうち fraction の割合の時間（残り時間は超えない）"""
+        return min(self.budget * fraction, self.remaining())
+
+def hedged(
+    call: Callable[[Optional[float]], T],
+    delay: float,
+    executor: Executor,
+    timeout: Optional[float] = None
+) -> T:
+    """delay 秒以内に応答がなければ同じ呼び出しをもう一つ送り、先に成功した結果を返す
+
+    冪等な呼び出しにだけ使うこと。call には待てる残り時間（秒、timeout がなければ None）を渡す。
+    timeout 秒を過ぎても結果がなければ TimeoutError を送出し、残り時間が delay に満たなければ
+    もう一つは送らない。両方失敗した場合は後に失敗した方の例外を送出する
+    """
+    started_at = time.monotonic()
+
+    def remaining() -> Optional[float]:
+        return None if timeout is None else max(0.0, timeout - (time.monotonic() - started_at))
+
+    first = executor.submit(call, timeout)
+    done, _ = wait([first], timeout=delay if timeout is None else min(delay, timeout))
+    if done:
+        return first.result()
+
+    left = remaining()
+    if left is not None and left < delay:
+        # もう一つ送っても残り時間内に応答を待てないため、最初の呼び出しだけを待つ
+        return first.result(timeout=left)
+
+    pending = {first, executor.submit(call, left)}
+    error: BaseException = TimeoutError("応答がありません")
+    while pending:
+        done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+        if not done:
+            raise TimeoutError("応答がありません")
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
@@ -0,0 +1,122 @@
+"""市区町村から天気予報の予報区域への対応表
+
+天気予報 API（weather.tsukumijima.net）の地域コードは、気象庁の一次細分区域ごとの代表地点のもの。
+同じ一次細分区域の市区町村は同じ予報になるため、区域ごとに市区町村をまとめて持つ。
+"""
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+# 都道府県ごとの主要な予報区域（府県庁所在地の区域）。対応表にない市区町村はここを使う
+PREFECTURE_OFFICES = {
+    "北海道": "016010",
+    "東京都": "130010",
+    "神奈川県": "140010",
+    "埼玉県": "110010",
+    "千葉県": "120010",
+    "大阪府": "270000",
+    "京都府": "260010",
+    "兵庫県": "280010",
+    "愛知県": "230010",
+    "福岡県": "400010"
+}
+
+# 都道府県 → 予報区域の地域コード → 市区町村
+FORECAST_AREAS: Dict[str, Dict[str, List[str]]] = {
+    "北海道": {
+        "016010": ["札幌市"],  # 石狩地方
+        "012010": ["旭川市"],  # 上川地方
+        "017010": ["函館市"],  # 渡島地方
+        "014020": ["釧路市"],  # 釧路地方
+        "014030": ["帯広市"],  # 十勝地方
+        "013020": ["北見市"]   # 網走・北見・紋別地方
+    },
+    "東京都": {
+        "130010": [  # 東京地方
+            "千代田区", "中央区", "港区", "新宿区", "文京区", "台東区",
+            "墨田区", "江東区", "品川区", "目黒区", "大田区", "世田谷区",
+            "渋谷区", "中野区", "杉並区", "豊島区", "北区", "荒川区",
+            "板橋区", "練馬区", "足立区", "葛飾区", "江戸川区"
+        ]
+    },
+    "神奈川県": {
+        "140010": ["横浜市", "川崎市", "横須賀市", "藤沢市", "茅ヶ崎市"],  # 東部
+        "140020": ["相模原市"]  # 西部
+    },
+    "埼玉県": {
+        "110010": ["さいたま市", "川越市", "川口市", "所沢市", "越谷市", "草加市"]  # 南部
+    },
+    "千葉県": {
+        "120010": ["千葉市", "市川市", "船橋市", "松戸市", "柏市", "浦安市"]  # 北西部
+    },
+    "大阪府": {
+        "270000": ["大阪市", "堺市", "豊中市", "吹田市", "高槻市", "茨木市"]
+    },
+    "京都府": {
+        "260010": ["京都市", "宇治市", "亀岡市"]  # 南部
+    },
+    "兵庫県": {
+        "280010": ["神戸市", "姫路市", "西宮市", "尼崎市", "明石市"]  # 南部
+    },
+    "愛知県": {
+        "230010": ["名古屋市", "岡崎市", "一宮市", "豊田市"],  # 西部
+        "230020": ["豊橋市"]  # 東部
+    },
+    "福岡県": {
+        "400010": ["福岡市", "春日市"],  # 福岡地方
+        "400020": ["北九州市"],  # 北九州地方
+        "400040": ["久留米市"]  # 筑後地方
+    }
+}
+
+class AreaIndex:
+    """選択できる市区町村ごとの予報区域の地域コード
+
+    作成時に選択肢のすべての市区町村が対応表にあるかを確かめ、ない市区町村は
+    都道府県の主要な予報区域を使う
+    """
+
+    def __init__(
+        self,
+        locations: Mapping[str, Sequence[str]],
+        areas: Mapping[str, Mapping[str, Sequence[str]]] = FORECAST_AREAS,
+        offices: Mapping[str, str] = PREFECTURE_OFFICES
+    ):
+        self._offices = dict(offices)
+        self._codes: Dict[Tuple[str, str], str] = {}
+        # 都道府県を指定しない検索用（市区町村名 → 地域コード。複数の区域にある名前は None）
+        self._by_city: Dict[str, Optional[str]] = {}
+
+        missing = []
+        for prefecture, cities in locations.items():
+            office = self._offices.get(prefecture)
+            if office is None:
+                raise ValueError(f"主要な予報区域が未登録の都道府県です: {prefecture}")
+            city_codes = {}
+            for area_code, area_cities in areas.get(prefecture, {}).items():
+                # 地域コードの先頭2桁は都道府県（北海道は 01）
+                if area_code[:2] != office[:2]:
+                    raise ValueError(f"{prefecture}の予報区域ではありません: {area_code}")
+                city_codes.update((city, area_code) for city in area_cities)
+
+            for city in cities:
+                area_code = city_codes.get(city)
+                if area_code is None:
+                    missing.append(f"{prefecture}{city}")
+                    area_code = office
+                self._codes[(prefecture, city)] = area_code
+                if city in self._by_city and self._by_city[city] != area_code:
+                    self._by_city[city] = None
+                else:
+                    self._by_city[city] = area_code
+
+        if missing:
+            print(f"予報区域が未登録のため都道府県の主要な区域を使います: {', '.join(missing)}")
+
+    def resolve(self, city: str, prefecture: Optional[str] = None) -> Optional[str]:
+        """市区町村の地域コード（都道府県の指定がなければ市区町村名だけで探す。見つからなければ None）"""
+        if prefecture is not None:
+            return self._codes.get((prefecture, city)) or self._offices.get(prefecture)
+        return self._by_city.get(city)
+
+    def area_codes(self) -> List[str]:
+        """選択肢の市区町村が使う予報区域の地域コード"""
+        return sorted(set(self._codes.values()))
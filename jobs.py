@@ -0,0 +1,202 @@
+"""生成処理のバックグラウンド実行
+
+スクリプトの再実行（ウィジェットの操作や二度押し）で処理が捨てられないよう、生成は
+プロセス全体で共有するスレッドで実行し、進み具合と結果はスクリプトの外に保持する。
+同じ入力の送信は、実行中または完了したばかりのジョブに合流する。
+表示した結果はセッションごとにも保持し、再実行のたびに取得し直さずに表示する。
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_current = threading.local()
+
+def current_job() -> Optional["Job"]:
+    """このスレッドで実行中のジョブ（ジョブの外では None）"""
+    return getattr(_current, "job", None)
+
+def bind_job(job: Optional["Job"]) -> None:
+    """このスレッドを job の処理として扱う（ジョブから起動したワーカースレッド用）"""
+    _current.job = job
+
+class Job:
+    """1件の生成処理の進み具合と結果"""
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.submitted_at = time.time()
+        self._changed = threading.Condition()
+        self._version = 0
+        self._state = {
+            "status": QUEUED,
+            "stage": "",
+            "partial": "",
+            # 結果のうち先に決まった部分（天気・ニュースなど）
+            "parts": {},
+            "result": None,
+            "error": None,
+            "errors": [],
+            "finished_at": None
+        }
+
+    def _update(self, **fields) -> None:
+        with self._changed:
+            self._state.update(fields)
+            self._version += 1
+            self._changed.notify_all()
+
+    def update(self, stage: Optional[str] = None, partial: Optional[str] = None) -> None:
+        """処理中の段階と生成途中の本文を更新する"""
+        fields = {"status": RUNNING}
+        if stage is not None:
+            fields["stage"] = stage
+        if partial is not None:
+            fields["partial"] = partial
+        self._update(**fields)
+
+    def publish(self, name: str, value: object) -> None:
+        """結果のうち先に決まった部分を記録する（ページで届いた順に表示する）"""
+        with self._changed:
+            self._state["parts"] = {**self._state["parts"], name: value}
+            self._version += 1
+            self._changed.notify_all()
+
+    def add_error(self, message: str) -> None:
+        """画面に出すエラーを記録する（ジョブのスレッドからは st.error を使えないため）"""
+        with self._changed:
+            self._state["errors"] = self._state["errors"] + [message]
+            self._version += 1
+            self._changed.notify_all()
+
+    def finish(self, result: Dict) -> None:
+        self._update(status=DONE, result=result, finished_at=time.time())
+
+    def fail(self, error: str) -> None:
+        self._update(status=FAILED, error=error, finished_at=time.time())
+
+    def snapshot(self) -> Tuple[int, Dict]:
+        """更新の番号と、その時点の状態のコピー"""
+        with self._changed:
+            return self._version, dict(self._state)
+
+    def wait(self, version: int, timeout: float) -> int:
+        """version から更新されるか終わるまで最長 timeout 秒待ち、最新の番号を返す"""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self._version != version or self._state["finished_at"] is not None,
+                timeout
+            )
+            return self._version
+
+    @property
+    def finished(self) -> bool:
+        with self._changed:
+            return self._state["finished_at"] is not None
+
+    @property
+    def failed(self) -> bool:
+        with self._changed:
+            return self._state["status"] == FAILED
+
+class JobQueue:
+    """入力ごとに1つだけ生成処理を実行するキュー（プロセス内で共有）
+
+    終わったジョブは result_ttl 秒だけ残し、同じ入力の送信にはその結果を返す。
+    失敗したジョブは残さず、次の送信でやり直す
+    """
+
+    def __init__(self, max_workers: int = 4, result_ttl: float = 300.0, max_jobs: int = 200):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._result_ttl = result_ttl
+        self._max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs: Dict[Hashable, Job] = {}
+
+    def submit(self, key: Hashable, func: Callable[[Job], Dict]) -> Tuple[Job, bool]:
+        """key のジョブを開始する。同じ key のジョブがあればそれを返す（新しく開始したかどうかも返す）"""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(key)
+            if job is not None and not job.failed:
+                return job, False
+            job = Job(key)
+            self._jobs[key] = job
+        self._executor.submit(self._run, job, func)
+        return job, True
+
+    def get(self, key: Hashable) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(key)
+
+    def in_flight(self) -> int:
+        """終わっていないジョブの数"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _run(self, job: Job, func: Callable[[Job], Dict]) -> None:
+        bind_job(job)
+        try:
+            job.update()
+            job.finish(func(job))
+        except Exception as e:
+            print(f"ジョブが失敗しました: {job.key}: {str(e)}")
+            job.fail(str(e))
+        finally:
+            bind_job(None)
+
+    def _prune(self) -> None:
+        """期限の過ぎたジョブと、上限を超えた古い終了済みのジョブを取り除く（ロックを持って呼ぶ）"""
+        now = time.time()
+        finished: List[Tuple[float, Hashable]] = []
+        for key, job in list(self._jobs.items()):
+            _, state = job.snapshot()
+            if state["finished_at"] is None:
+                continue
+            if state["status"] == FAILED or now - state["finished_at"] > self._result_ttl:
+                del self._jobs[key]
+            else:
+                finished.append((state["finished_at"], key))
+        overflow = len(self._jobs) - self._max_jobs
+        for _, key in sorted(finished)[:max(overflow, 0)]:
+            del self._jobs[key]
+
+class SessionResults:
+    """セッションごとの生成結果（入力の組 → 結果。最近使ったものから max_entries 件を保持）"""
+
+    def __init__(self, max_entries: int = 5):
+        self._max_entries = max_entries
+        self._results: "OrderedDict[Hashable, Dict]" = OrderedDict()
+        self._last_key: Optional[Hashable] = None
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        """key の結果（あれば最後に表示した結果にする）"""
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+            self._last_key = key
+        return result
+
+    def put(self, key: Hashable, result: Dict) -> None:
+        """結果を保存して最後に表示した結果にする（上限を超えたら古いものから捨てる）"""
+        self._results[key] = result
+        self._results.move_to_end(key)
+        self._last_key = key
+        while len(self._results) > self._max_entries:
+            self._results.popitem(last=False)
+
+    def last(self) -> Optional[Tuple[Hashable, Dict]]:
+        """最後に表示した結果の入力の組と結果"""
+        if self._last_key not in self._results:
+            return None
+        return self._last_key, self._results[self._last_key]
+
+    def clear(self) -> None:
+        self._results.clear()
+        self._last_key = None
@@ -0,0 +1,179 @@
+"""処理時間・キャッシュ・外部API・トークン数の計測
+
+Prometheus のテキスト形式で、HTTP エンドポイントまたはファイルに書き出す。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# ラベルの組と値
+Sample = Tuple[Dict[str, str], float]
+# 登録時以外に集める値（名前, 種類, 説明, 値の一覧）
+Collected = Tuple[str, str, str, List[Sample]]
+
+# 処理時間のヒストグラムの区切り（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape_label(value)}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    """増えるだけの値"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(key))} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """値の分布（処理時間など）"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self._buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # 区切りごとの件数、合計、件数
+            counts = self._values.setdefault(key, [0.0] * (len(self._buckets) + 2))
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """with ブロックの処理時間を記録する（例外が出ても記録する）"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                labels = dict(key)
+                for bound, count in zip(self._buckets, counts):
+                    bucket_labels = {**labels, "le": _format_value(bound)}
+                    lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {_format_value(count)}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(counts[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {_format_value(counts[-1])}")
+        return lines
+
+class MetricsRegistry:
+    """計測値の登録と Prometheus テキスト形式での出力"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], List[Collected]]] = []
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[Collected]]) -> None:
+        """出力のたびに呼び出して値を集める関数を登録する"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                print(f"計測値を集められませんでした: {str(e)}")
+                continue
+            for name, metric_type, help_text, samples in collected:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+###################
+# 書き出し
+###################
+
+def start_http_exporter(registry: MetricsRegistry, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """/metrics で計測値を返す HTTP サーバーをバックグラウンドで起動する"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # アクセスログは出さない
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def start_file_exporter(registry: MetricsRegistry, path: str, interval: float = 15.0) -> threading.Thread:
+    """計測値を一定間隔でファイルに書き出す（書き込み途中の内容が読まれないよう置き換える）"""
+
+    def loop() -> None:
+        while True:
+            try:
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(registry.render())
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"計測値を書き出せませんでした: {str(e)}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name="metrics-file", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,122 @@
+"""配信先違いの同じ記事（ほぼ重複）の除去
+
+タイトルと説明文の文字 n-gram（シングル）から MinHash の署名を作り、
+推定 Jaccard 類似度がしきい値以上の記事を同じ記事としてまとめる。
+シングルのハッシュと署名の計算は全記事分をまとめて NumPy で行う。
+"""
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# シングルの文字数
+SHINGLE_CHARS = 3
+# 署名の長さ（ハッシュ関数の数）
+NUM_PERM = 64
+# 同じ記事とみなす推定 Jaccard 類似度
+DUPLICATE_THRESHOLD = 0.5
+# 重複を調べる際に一度に比べる記事の数
+DEDUPE_BLOCK = 256
+
+# 空白と記号は比較に使わない（全角・半角は NFKC でそろえる）
+_IGNORED_CHARS = re.compile(r"[\W_]+")
+# 複数の文をまとめて正規化する際の区切り（区切りの文字は残す）
+_SEPARATOR = "\x00"
+_IGNORED_CHARS_BETWEEN = re.compile(r"[^\w\x00]+")
+
+# ハッシュ値を並べ替える関数 (a * h + b) mod 2^32 の係数（a は奇数なので 32 ビットの値の置換になる）。
+# プロセス間で同じ結果になるよう固定のシードで作る
+_rng = np.random.default_rng(20240501)
+_HASH_A = _rng.integers(0, 2**32, size=NUM_PERM, dtype=np.uint32) | np.uint32(1)
+_HASH_B = _rng.integers(0, 2**32, size=NUM_PERM, dtype=np.uint32)
+
+def normalize_text(text: str) -> str:
+    """比較用に NFKC で正規化し、小文字にして空白と記号を除く"""
+    return _IGNORED_CHARS.sub("", unicodedata.normalize("NFKC", text).lower())
+
+def normalize_texts(texts: List[str]) -> List[str]:
+    """複数の文の normalize_text（NFKC は文ごとの方が速いため、小文字化と記号の除去だけつなげて一度に行う）"""
+    joined = _SEPARATOR.join(unicodedata.normalize("NFKC", text) for text in texts).lower().replace("_", "")
+    normalized = _IGNORED_CHARS_BETWEEN.sub("", joined).split(_SEPARATOR)
+    if len(normalized) != len(texts):
+        # 区切りの文字を含む文があった場合
+        return [normalize_text(text) for text in texts]
+    return normalized
+
+def shingle_hashes(texts: List[str], k: int = SHINGLE_CHARS) -> Tuple[np.ndarray, np.ndarray]:
+    """全文の文字 k-gram の 32 ビットのハッシュと、文ごとの先頭の位置
+
+    文をつなげた一つのコードポイントの配列で計算し、文の境界をまたぐ k-gram は除く。
+    k 文字に満たない文は全体を一つのシングルにする
+    """
+    padded = [text.ljust(k, "\0") for text in texts]
+    lengths = np.array([len(text) for text in padded])
+    codes = np.frombuffer("".join(padded).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+
+    # 連続する k 文字のコードポイントを多項式ハッシュでまとめる
+    windows = len(codes) - k + 1
+    hashes = np.zeros(windows, dtype=np.uint64)
+    for i in range(k):
+        hashes = hashes * np.uint64(1_000_003) + codes[i:windows + i]
+
+    counts = lengths - k + 1
+    offsets = np.cumsum(counts) - counts
+    text_starts = np.cumsum(lengths) - lengths
+    positions = np.repeat(text_starts - offsets, counts) + np.arange(counts.sum())
+    return (hashes[positions] & np.uint64(0xFFFFFFFF)).astype(np.uint32), offsets
+
+def minhash_signatures(texts: List[str]) -> np.ndarray:
+    """文ごとの MinHash の署名（文の数 × NUM_PERM）"""
+    hashes, offsets = shingle_hashes(normalize_texts(texts))
+    # 全文のシングルをハッシュ関数ごとに並べ替え、文の区切りごとに最小値を取る（32 ビットで桁あふれさせる）
+    permuted = _HASH_A[:, None] * hashes[None, :]
+    permuted += _HASH_B[:, None]
+    return np.minimum.reduceat(permuted, offsets, axis=1).T
+
+def dedupe_articles(
+    articles: List[Dict],
+    threshold: float = DUPLICATE_THRESHOLD,
+    limit: Optional[int] = None
+) -> List[Dict]:
+    """ほぼ重複する記事をまとめ、それぞれ最初の（スコアの高い順なら最もスコアの高い）記事だけを残す
+
+    limit を指定すると、先頭から limit 件の異なる記事が見つかった時点で打ち切る
+    （署名は必要な分だけ先頭から少しずつ計算する）
+    """
+    if len(articles) < 2 or limit == 0:
+        return articles[:limit]
+
+    # 署名の一致する数がこれ以上なら推定 Jaccard 類似度がしきい値以上
+    required = int(np.ceil(threshold * NUM_PERM))
+
+    def similar(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return (a[:, None, :] == b[None, :, :]).sum(axis=2) >= required
+
+    kept: List[int] = []
+    kept_signatures = np.empty((len(articles), NUM_PERM), dtype=np.uint32)
+    # ブロックごとに、残した記事とまとめて比べてから、ブロック内で先頭から順に残す記事を決める。
+    # limit がある場合は小さいブロックから始め、足りなければ倍にしていく
+    block_size = DEDUPE_BLOCK if limit is None else min(DEDUPE_BLOCK, 2 * limit)
+    start = 0
+    while start < len(articles) and (limit is None or len(kept) < limit):
+        block = minhash_signatures([
+            f"{article['title']} {article.get('description') or ''}"
+            for article in articles[start:start + block_size]
+        ])
+        duplicate = np.zeros(len(block), dtype=bool)
+        for kept_start in range(0, len(kept), DEDUPE_BLOCK):
+            duplicate |= similar(block, kept_signatures[kept_start:min(len(kept), kept_start + DEDUPE_BLOCK)]).any(axis=1)
+
+        candidates = np.flatnonzero(~duplicate)
+        within = similar(block[candidates], block[candidates])
+        alive = np.ones(len(candidates), dtype=bool)
+        for j in range(len(candidates)):
+            if alive[j]:
+                alive[j + 1:] &= ~within[j, j + 1:]
+        for j in candidates[alive]:
+            kept_signatures[len(kept)] = block[j]
+            kept.append(start + int(j))
+        start += len(block)
+        block_size = min(DEDUPE_BLOCK, block_size * 2)
+    return [articles[i] for i in kept[:limit]]
@@ -0,0 +1,159 @@
+"""NewsAPI で取得した記事のローカル全文検索索引（SQLite FTS5）
+
+取得した記事は URL で重複を除いて保存し、タイトルと説明文を trigram で索引する。
+検索語ごとに最後に NewsAPI で取得した時刻（カバレッジ）を記録し、
+新しければ索引だけで答えられるようにする。
+"""
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlite_local import ThreadLocalConnection
+
+# trigram で一致を調べられる最短の語の長さ（これより短い語は LIKE で探す）
+TRIGRAM_MIN_CHARS = 3
+
+def _iso(dt: datetime) -> str:
+    """NewsAPI の publishedAt と同じ形式（UTC）"""
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+class NewsIndex:
+    """記事の保存・全文検索とカバレッジの記録（同じホストのプロセス間で共有）"""
+
+    def __init__(self, path: str, retention_days: float = 30):
+        self._retention = retention_days * 86400
+        self._connect = ThreadLocalConnection(path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS articles (
+                    id INTEGER PRIMARY KEY,
+                    url TEXT NOT NULL UNIQUE,
+                    title TEXT NOT NULL,
+                    description TEXT,
+                    source TEXT,
+                    published_at TEXT NOT NULL,
+                    ingested_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS articles_published_at ON articles (published_at);
+
+                CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+                    title, description, content='articles', content_rowid='id', tokenize='trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS articles_ai AFTER INSERT ON articles BEGIN
+                    INSERT INTO articles_fts (rowid, title, description)
+                    VALUES (new.id, new.title, new.description);
+                END;
+                CREATE TRIGGER IF NOT EXISTS articles_ad AFTER DELETE ON articles BEGIN
+                    INSERT INTO articles_fts (articles_fts, rowid, title, description)
+                    VALUES ('delete', old.id, old.title, old.description);
+                END;
+                CREATE TRIGGER IF NOT EXISTS articles_au AFTER UPDATE ON articles BEGIN
+                    INSERT INTO articles_fts (articles_fts, rowid, title, description)
+                    VALUES ('delete', old.id, old.title, old.description);
+                    INSERT INTO articles_fts (rowid, title, description)
+                    VALUES (new.id, new.title, new.description);
+                END;
+
+                CREATE TABLE IF NOT EXISTS coverage (
+                    query_key TEXT PRIMARY KEY,
+                    covered_at REAL NOT NULL
+                );
+                """
+            )
+
+    def ingest(self, articles: List[Dict]) -> int:
+        """NewsAPI の記事を保存する（同じ URL は内容を更新する）。保存した件数を返す"""
+        rows = [
+            (
+                article["url"],
+                article["title"],
+                article.get("description") or "",
+                (article.get("source") or {}).get("name"),
+                article["publishedAt"],
+                time.time()
+            )
+            for article in articles
+            if article.get("url") and article.get("title") and article.get("publishedAt")
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT INTO articles (url, title, description, source, published_at, ingested_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    title = excluded.title,
+                    description = excluded.description,
+                    source = excluded.source,
+                    published_at = excluded.published_at,
+                    ingested_at = excluded.ingested_at
+                WHERE title != excluded.title OR description != excluded.description
+                """,
+                rows
+            )
+            # 保存期間を過ぎた記事を削除する
+            cutoff = datetime.fromtimestamp(time.time() - self._retention, timezone.utc)
+            conn.execute("DELETE FROM articles WHERE published_at < ?", (_iso(cutoff),))
+        return len(rows)
+
+    def search(self, terms: List[str], since: datetime, limit: int = 50) -> List[Dict]:
+        """いずれかの語を含む since 以降の記事を新しい順に返す（NewsAPI の記事と同じ形式）"""
+        long_terms = [term for term in terms if len(term) >= TRIGRAM_MIN_CHARS]
+        short_terms = [term for term in terms if term and len(term) < TRIGRAM_MIN_CHARS]
+        if not long_terms and not short_terms:
+            return []
+
+        matches = []
+        params: List = []
+        if long_terms:
+            matches.append("SELECT rowid FROM articles_fts WHERE articles_fts MATCH ?")
+            params.append(" OR ".join('"' + term.replace('"', '""') + '"' for term in long_terms))
+        for term in short_terms:
+            # trigram の索引が使えない短い語は部分一致で探す
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            matches.append(
+                "SELECT rowid FROM articles_fts "
+                "WHERE title LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\'"
+            )
+            params.extend([pattern, pattern])
+
+        rows = self._connect().execute(
+            f"""
+            SELECT title, description, url, source, published_at FROM articles
+            WHERE published_at >= ? AND id IN ({" UNION ".join(matches)})
+            ORDER BY published_at DESC
+            LIMIT ?
+            """,
+            [_iso(since), *params, limit]
+        ).fetchall()
+        return [
+            {
+                "title": title,
+                "description": description,
+                "url": url,
+                "source": {"name": source},
+                "publishedAt": published_at
+            }
+            for title, description, url, source, published_at in rows
+        ]
+
+    def texts(self) -> List[str]:
+        """保存している記事のタイトルと説明文（評価の idf を求めるコーパス）"""
+        rows = self._connect().execute("SELECT title, description FROM articles").fetchall()
+        return [title + " " + (description or "") for title, description in rows]
+
+    def mark_covered(self, query_key: str) -> None:
+        """検索語を NewsAPI で取得した時刻を記録する"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO coverage (query_key, covered_at) VALUES (?, ?)",
+                (query_key, time.time())
+            )
+
+    def coverage_age(self, query_key: str) -> Optional[float]:
+        """検索語を最後に NewsAPI で取得してからの秒数（取得したことがなければ None）"""
+        row = self._connect().execute(
+            "SELECT covered_at FROM coverage WHERE query_key = ?", (query_key,)
+        ).fetchone()
+        return time.time() - row[0] if row else None
@@ -0,0 +1,267 @@
+"""ニュース記事の評価
+
+関連度は、タイトルと説明文を文字 n-gram の TF-IDF ベクトルにして、検索語のベクトルとの
+コサイン類似度を記事群全体でまとめて NumPy で求める（日本語は語の区切りがないため、
+2文字の n-gram で語の一致を近似する。全角・半角や大文字・小文字の違いは正規化でそろえる）。
+idf は評価する記事群ではなく、蓄積した記事（ローカル索引など）から一度だけ求めた NgramIdf を使い、
+同じ記事のスコアがページや取得経路によって変わらないようにする。
+NGワードとドメインの信頼度はそれぞれ一つの正規表現にまとめてインポート時にコンパイルし、
+記事ごとに一度の走査で判定する。
+配信先違いの同じ記事は、スコアの最も高いものだけを残す（使う件数が決まっていれば、
+上位からその件数の異なる記事が見つかるまでだけ調べる）。
+"""
+import math
+import re
+import unicodedata
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Pattern, Sequence, Tuple
+
+import numpy as np
+
+from news_dedup import dedupe_articles, shingle_hashes
+
+# NGワードリスト
+NG_WORDS = ["ちょいブス", "エ□", "まとめ", "2ch", "アフィリエイト", "まとめサイト", "速報"]
+
+# 信頼度の高いドメインとスコアの倍率（上から順に判定）
+DOMAIN_TIERS = [
+    (["nikkei.com", "reuters.com", "bloomberg.", "nhk.or.jp"], 1.5),
+    (["itmedia.co.jp", "techcrunch.com", "businessinsider.jp"], 1.3)
+]
+
+# 全文をつなげて正規化するときの区切り（NFKC で変わらず、記事の文には現れない文字）
+_SEPARATOR = "\x00"
+
+# 関連度に使う文字 n-gram の長さ（これより短い語は関連度に使わない）
+NGRAM_LENGTHS = (2,)
+
+# 見出しに検索語が1回含まれる記事の典型的なコサイン類似度（ローカル索引の idf で測った値）。
+# 関連度は類似度をこの値で割って一致の重みを掛け、しきい値は部分文字列の一致の頃と同じものを使う
+MATCH_SIMILARITY = 0.05
+
+# 一致の重み（企業はタイトル・説明文、業界は検索語1語ごとのタイトル・説明文）
+COMPANY_TITLE_WEIGHT = 5
+COMPANY_DESCRIPTION_WEIGHT = 3
+INDUSTRY_TITLE_WEIGHT = 2
+INDUSTRY_DESCRIPTION_WEIGHT = 1
+
+# 最小スコアのしきい値
+COMPANY_SCORE_THRESHOLD = 3
+INDUSTRY_SCORE_THRESHOLD = 2
+
+def compile_words(words: Iterable[str]) -> Pattern:
+    """語の集合を小文字の文字列用の一つの正規表現にまとめる"""
+    alternatives = sorted({word.lower() for word in words}, key=len, reverse=True)
+    return re.compile("|".join(re.escape(word) for word in alternatives))
+
+NG_WORDS_PATTERN = compile_words(NG_WORDS)
+DOMAIN_TIER_PATTERNS = [(compile_words(domains), multiplier) for domains, multiplier in DOMAIN_TIERS]
+
+def domain_multiplier(url_lower: str) -> float:
+    """URL のドメインによるスコアの倍率"""
+    for pattern, multiplier in DOMAIN_TIER_PATTERNS:
+        if pattern.search(url_lower):
+            return multiplier
+    return 1.0
+
+def recency_scores(published_at: List[str], now: datetime) -> np.ndarray:
+    """新しい記事ほど高いスコア（公開日からの日数で下げる）"""
+    days_old = (
+        np.datetime64(now.date(), "D") - np.array([value[:10] for value in published_at], dtype="datetime64[D]")
+    ).astype(np.int64)
+    return np.maximum(0, 2 - days_old * 0.1)
+
+###################
+# 文字 n-gram の TF-IDF
+###################
+
+def normalize_for_ngrams(texts: List[str]) -> List[str]:
+    """n-gram を作る前の正規化（NFKC で全角・半角をそろえて小文字にする。全文をつなげて一度に行う）"""
+    normalized = unicodedata.normalize("NFKC", _SEPARATOR.join(texts)).lower().split(_SEPARATOR)
+    if len(normalized) != len(texts):
+        # 区切りの文字を含む文があった場合
+        return [unicodedata.normalize("NFKC", text).lower() for text in texts]
+    return normalized
+
+def ngram_counts(texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """正規化済みの文ごとの文字 n-gram の出現数（文の番号, n-gram のハッシュ, 出現数）"""
+    if not texts:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, np.empty(0, dtype=np.uint32), empty
+
+    keys = []
+    for length in NGRAM_LENGTHS:
+        hashes, offsets = shingle_hashes(texts, length)
+        counts = np.diff(np.append(offsets, len(hashes)))
+        documents = np.repeat(np.arange(len(texts), dtype=np.uint64), counts)
+        keys.append((documents << np.uint64(32)) | hashes.astype(np.uint64))
+    keys, counts = np.unique(np.concatenate(keys), return_counts=True)
+    return (keys >> np.uint64(32)).astype(np.intp), (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32), counts
+
+class NgramIdf:
+    """文字 n-gram の idf（蓄積した記事から一度だけ求める）
+
+    評価する記事群によって値が変わらないよう、ローカル索引などの記事の集合から作って使い回す。
+    記事の集合にない n-gram は最も珍しいものとして扱い、集合が空ならすべての重みを 1 とする
+    """
+
+    def __init__(self, texts: Sequence[str] = ()):
+        self.documents = len(texts)
+        _, hashes, _ = ngram_counts(normalize_for_ngrams(list(texts)))
+        # 文ごとに一つずつになっているため、ハッシュの出現数が文書頻度
+        self._hashes, frequencies = np.unique(hashes, return_counts=True)
+        self._idf = np.log((1 + self.documents) / (1 + frequencies)) + 1
+        self._unseen = math.log(1 + self.documents) + 1
+
+    def weights(self, hashes: np.ndarray) -> np.ndarray:
+        """n-gram のハッシュごとの idf"""
+        if not len(self._hashes):
+            return np.full(len(hashes), self._unseen)
+        positions = np.minimum(np.searchsorted(self._hashes, hashes), len(self._hashes) - 1)
+        return np.where(self._hashes[positions] == hashes, self._idf[positions], self._unseen)
+
+# idf の元になる記事がない場合（すべての n-gram を同じ重みとする）
+UNIFORM_IDF = NgramIdf()
+
+class TfidfQuery:
+    """検索語の組ごとの TF-IDF ベクトル（長さを 1 にそろえる）
+
+    組の中の語は一つのベクトルにまとめる（語をまたぐ n-gram は作らない）
+    """
+
+    def __init__(self, queries: List[List[str]], idf: NgramIdf):
+        terms, owners = [], []
+        for number, query in enumerate(queries):
+            for term in normalize_for_ngrams(query):
+                if len(term) >= min(NGRAM_LENGTHS):
+                    terms.append(term)
+                    owners.append(number)
+        term_numbers, hashes, counts = ngram_counts(terms)
+        # 検索語に現れる n-gram のハッシュ（昇順）と、組ごとの重み（組の数 × n-gram の数）
+        self.hashes, positions = np.unique(hashes, return_inverse=True)
+        self.matrix = np.zeros((len(queries), len(self.hashes)))
+        np.add.at(self.matrix, (np.array(owners, dtype=np.intp)[term_numbers], positions), counts)
+        self.matrix *= idf.weights(self.hashes)
+        self.matrix /= np.maximum(np.linalg.norm(self.matrix, axis=1, keepdims=True), 1e-12)
+
+class TfidfMatrix:
+    """文ごとの文字 n-gram の TF-IDF ベクトル（疎行列として保持し、検索語との類似度をまとめて求める）"""
+
+    def __init__(self, texts: List[str], idf: NgramIdf):
+        self._size = len(texts)
+        self._documents, self._hashes, counts = ngram_counts(normalize_for_ngrams(texts))
+        self._weights = counts * idf.weights(self._hashes)
+        self._norms = np.sqrt(np.bincount(self._documents, self._weights ** 2, minlength=self._size))
+
+    def similarities(self, query: TfidfQuery) -> np.ndarray:
+        """検索語の組ごと・文ごとのコサイン類似度（検索語の組の数 × 文の数）"""
+        if not len(query.hashes):
+            return np.zeros((len(query.matrix), self._size))
+
+        # 文の n-gram のうち検索語にあるものだけを、文の数 × 検索語の n-gram の数の行列にする
+        positions = np.minimum(np.searchsorted(query.hashes, self._hashes), len(query.hashes) - 1)
+        matched = query.hashes[positions] == self._hashes
+        width = len(query.hashes)
+        weights = np.bincount(
+            self._documents[matched] * width + positions[matched],
+            self._weights[matched],
+            minlength=self._size * width
+        ).reshape(self._size, width)
+        return (query.matrix @ weights.T) / np.maximum(self._norms, 1e-12)
+
+###################
+# 記事の評価
+###################
+
+def _scored_article(article: Dict, score: float) -> Dict:
+    return {
+        "title": article["title"],
+        "description": article["description"],
+        "url": article["url"],
+        "published_at": article["publishedAt"],
+        "relevance_score": score
+    }
+
+def _score_articles(
+    articles: List[Dict],
+    queries: List[List[str]],
+    title_weight: float,
+    description_weight: float,
+    threshold: float,
+    boost_relevance_only: bool,
+    idf: Optional[NgramIdf],
+    now: Optional[datetime],
+    limit: Optional[int]
+) -> List[Dict]:
+    """NGワードを含まない記事を評価し、しきい値以上の記事を重複を除いてスコアの降順で返す
+
+    関連度は queries（検索語の組）ごとの類似度の合計。boost_relevance_only ならドメインの倍率を
+    関連度だけに掛け、そうでなければ新しさを足した後に掛ける
+    """
+    now = now or datetime.now()
+    # NGワードチェック
+    candidates = [article for article in articles if not NG_WORDS_PATTERN.search(article["title"].lower())]
+    if not candidates:
+        return []
+
+    idf = idf or UNIFORM_IDF
+    query = TfidfQuery(queries, idf)
+    titles = TfidfMatrix([article["title"] for article in candidates], idf)
+    descriptions = TfidfMatrix([article["description"] or "" for article in candidates], idf)
+    relevance = (
+        title_weight * titles.similarities(query).sum(axis=0)
+        + description_weight * descriptions.similarities(query).sum(axis=0)
+    ) / MATCH_SIMILARITY
+    recency = recency_scores([article["publishedAt"] for article in candidates], now)
+    multipliers = np.array([domain_multiplier(article["url"].lower()) for article in candidates])
+    if boost_relevance_only:
+        scores = relevance * multipliers + recency
+    else:
+        scores = (relevance + recency) * multipliers
+
+    # しきい値以上の記事だけをスコアの降順に並べる（同点は元の順）
+    passed = np.flatnonzero(scores >= threshold)
+    order = passed[np.argsort(-scores[passed], kind="stable")]
+    if limit is None:
+        return dedupe_articles([_scored_article(candidates[i], float(scores[i])) for i in order])
+
+    # 上位から必要な分だけ結果を作り、重複を除いて足りなければ範囲を倍にする
+    count = 4 * limit
+    while True:
+        scored = [_scored_article(candidates[i], float(scores[i])) for i in order[:count]]
+        kept = dedupe_articles(scored, limit=limit)
+        if len(kept) >= limit or count >= len(order):
+            return kept
+        count *= 2
+
+def score_company_articles(
+    articles: List[Dict],
+    company_name: str,
+    now: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    idf: Optional[NgramIdf] = None
+) -> List[Dict]:
+    """企業ニュースを評価し、しきい値以上の記事を重複を除いてスコアの降順で返す（limit 件まで）
+
+    関連度（会社名との類似度、タイトル重視）と新しさの合計にドメインの倍率を掛ける
+    """
+    return _score_articles(
+        articles, [[company_name]], COMPANY_TITLE_WEIGHT, COMPANY_DESCRIPTION_WEIGHT,
+        COMPANY_SCORE_THRESHOLD, False, idf, now, limit
+    )
+
+def score_industry_articles(
+    articles: List[Dict],
+    search_terms: List[str],
+    now: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    idf: Optional[NgramIdf] = None
+) -> List[Dict]:
+    """業界ニュースを評価し、しきい値以上の記事を重複を除いてスコアの降順で返す（limit 件まで）
+
+    関連度（検索語ごとの類似度の合計、タイトル重視）にドメインの倍率を掛け、新しさを足す
+    """
+    return _score_articles(
+        articles, [[term] for term in search_terms], INDUSTRY_TITLE_WEIGHT, INDUSTRY_DESCRIPTION_WEIGHT,
+        INDUSTRY_SCORE_THRESHOLD, True, idf, now, limit
+    )
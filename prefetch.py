@@ -0,0 +1,148 @@
+"""キャッシュの事前取得（バックグラウンドスケジューラ）"""
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Generic, Hashable, List, Optional, Sequence, Set, TypeVar
+
+from timezones import JST
+
+T = TypeVar("T")
+
+class QuotaBudget:
+    """1日あたりの取得回数の上限"""
+
+    def __init__(self, daily_limit: int):
+        self.daily_limit = daily_limit
+        self._lock = threading.Lock()
+        self._day = datetime.now(JST).date()
+        self._used = 0
+
+    def remaining(self) -> int:
+        """今日の残り回数"""
+        with self._lock:
+            self._roll_over()
+            return max(0, self.daily_limit - self._used)
+
+    def try_acquire(self) -> bool:
+        """1回分を消費する（上限に達していれば False）"""
+        with self._lock:
+            self._roll_over()
+            if self._used >= self.daily_limit:
+                return False
+            self._used += 1
+            return True
+
+    def _roll_over(self) -> None:
+        today = datetime.now(JST).date()
+        if today != self._day:
+            self._day = today
+            self._used = 0
+
+class RoundRobin(Generic[T]):
+    """キーを順番に少しずつ取り出す"""
+
+    def __init__(self, keys: Sequence[T]):
+        self._keys = list(keys)
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def take(self, count: int) -> List[T]:
+        count = min(count, len(self._keys))
+        keys = [self._keys[(self._cursor + i) % len(self._keys)] for i in range(count)]
+        self._cursor = (self._cursor + count) % max(1, len(self._keys))
+        return keys
+
+class RefreshQueue:
+    """キーごとに1つだけ実行する取り直し（古い値で答えたあと、バックグラウンドで取得し直す）"""
+
+    def __init__(self, max_workers: int = 2):
+        self._lock = threading.Lock()
+        self._pending: Set[Hashable] = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="refresh")
+
+    def submit(self, key: Hashable, run: Callable[[], None]) -> bool:
+        """key の取り直しを登録する（同じ key が実行中か待機中なら何もせず False）"""
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+
+        def refresh() -> None:
+            try:
+                run()
+            except Exception as e:
+                print(f"取り直しに失敗しました: {key}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        self._executor.submit(refresh)
+        return True
+
+class PrefetchTask:
+    """定期的に実行する事前取得の処理"""
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[], None],
+        next_run: Callable[[datetime], datetime],
+        jitter: float
+    ):
+        self.name = name
+        self.run = run
+        self.next_run = next_run
+        self.jitter = jitter
+        self.due_at = datetime.now(JST)
+
+    def reschedule(self, now: datetime) -> None:
+        # 複数のプロセスが同時に取得しないよう実行時刻をずらす
+        self.due_at = self.next_run(now) + timedelta(seconds=random.uniform(0, self.jitter))
+
+class PrefetchScheduler:
+    """事前取得の処理を時刻表どおりに実行するバックグラウンドスレッド"""
+
+    def __init__(self):
+        self._tasks: List[PrefetchTask] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_task(
+        self,
+        name: str,
+        run: Callable[[], None],
+        next_run: Callable[[datetime], datetime],
+        jitter: float = 0.0,
+        run_immediately: bool = True
+    ) -> None:
+        """処理を登録する（next_run は現在時刻から次の実行時刻を求める）"""
+        task = PrefetchTask(name, run, next_run, jitter)
+        if not run_immediately:
+            task.reschedule(datetime.now(JST))
+        self._tasks.append(task)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            task = min(self._tasks, key=lambda t: t.due_at)
+            wait = (task.due_at - datetime.now(JST)).total_seconds()
+            if wait > 0:
+                # 停止の合図か実行時刻まで待つ
+                self._stop.wait(wait)
+                continue
+
+            try:
+                task.run()
+            except Exception as e:
+                print(f"事前取得に失敗しました: {task.name}: {str(e)}")
+            task.reschedule(datetime.now(JST))
@@ -0,0 +1,191 @@
+"""外部APIの呼び出し回数の制限とサーキットブレーカー（プロセス間で共有）
+
+取得元ごとにトークンバケットで呼び出しのペースをならし、1日の呼び出し回数を上限まで数える。
+失敗が続いた取得元や上限に達した取得元はしばらく呼び出さずにすぐ失敗させ、
+呼び出し側はキャッシュ（期限切れの値を含む）で答える。
+状態は SQLite ファイルに置き、同じホストのプロセス間で共有する。
+"""
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+from sqlite_local import ThreadLocalConnection
+from timezones import JST
+
+# 呼び出しを断った理由
+OPEN = "open"  # サーキットブレーカーが開いている
+QUOTA = "quota"  # 1日の上限に達した
+RATE = "rate"  # トークンバケットが空
+
+# upstreams テーブルの1行（トークン数, 補充した時刻, 日付, 今日の呼び出し回数, 連続した失敗の回数, ブレーカーを閉じる時刻）
+State = Tuple[float, float, str, int, int, float]
+
+class UpstreamUnavailable(Exception):
+    """取得元を呼び出せない（呼び出し回数の制限中か、サーキットブレーカーが開いている）"""
+
+    def __init__(self, upstream: str, reason: str, retry_after: float):
+        super().__init__(f"{upstream} の呼び出しを制限中です（{reason}、約{retry_after:.0f}秒後に再開）")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+class RateLimiter:
+    """取得元ごとの呼び出し回数の制限とサーキットブレーカー
+
+    limits は取得元 → {"rate_per_minute", "burst", "daily_limit", "reserve"}（0 は制限なし）。
+    reserve はバックグラウンドの呼び出し（事前取得）に使わせず、利用者の検索のために残す
+    バーストと1日の上限の割合。limits にない取得元は制限しない。連続して failure_threshold 回失敗すると
+    open_seconds 秒ブレーカーを開き、その後は1回だけ試しに呼び出して、成功すれば閉じる。
+    状態の読み書きに失敗した場合は呼び出しを止めない
+    """
+
+    def __init__(
+        self,
+        path: str,
+        limits: Mapping[str, Mapping[str, float]],
+        failure_threshold: int = 5,
+        open_seconds: float = 30.0,
+        rate_limited_seconds: float = 900.0
+    ):
+        self._limits = {upstream: dict(values) for upstream, values in limits.items()}
+        self._failure_threshold = failure_threshold
+        self._open_seconds = open_seconds
+        self._rate_limited_seconds = rate_limited_seconds
+        self._connect = ThreadLocalConnection(path, isolation_level=None, pragmas=["synchronous=NORMAL"])
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS upstreams (
+                    upstream TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    refilled_at REAL NOT NULL,
+                    day TEXT NOT NULL,
+                    used INTEGER NOT NULL,
+                    failures INTEGER NOT NULL,
+                    open_until REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """他のプロセスの書き込みを待ってから読み書きするトランザクション"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _load(self, conn: sqlite3.Connection, upstream: str, now: float) -> State:
+        """取得元の状態（日付が変わっていれば回数を戻し、トークンを経過時間の分だけ補充する）"""
+        limits = self._limits[upstream]
+        today = datetime.fromtimestamp(now, JST).date().isoformat()
+        row = conn.execute(
+            "SELECT tokens, refilled_at, day, used, failures, open_until FROM upstreams WHERE upstream = ?",
+            (upstream,)
+        ).fetchone()
+        if row is None:
+            return float(limits["burst"]), now, today, 0, 0, 0.0
+
+        tokens, refilled_at, day, used, failures, open_until = row
+        if day != today:
+            day, used = today, 0
+        tokens = min(float(limits["burst"]), tokens + max(0.0, now - refilled_at) * limits["rate_per_minute"] / 60)
+        return tokens, now, day, used, failures, open_until
+
+    def _save(self, conn: sqlite3.Connection, upstream: str, state: State) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO upstreams "
+            "(upstream, tokens, refilled_at, day, used, failures, open_until) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (upstream, *state)
+        )
+
+    def acquire(self, upstream: str, background: bool = False) -> None:
+        """1回分の呼び出しを許可する（呼び出せなければ UpstreamUnavailable を送出する）
+
+        background の呼び出しは、バーストと1日の上限のうち reserve の割合を残して断る
+        """
+        limits = self._limits.get(upstream)
+        if limits is None:
+            return
+
+        reserve = limits.get("reserve", 0.0) if background else 0.0
+        daily_limit = limits["daily_limit"] * (1 - reserve)
+        token_floor = limits["burst"] * reserve
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                tokens, refilled_at, day, used, failures, open_until = self._load(conn, upstream, now)
+                if open_until > now:
+                    raise UpstreamUnavailable(upstream, OPEN, open_until - now)
+                if limits["daily_limit"] and used >= daily_limit:
+                    tomorrow = datetime.fromisoformat(day).replace(tzinfo=JST) + timedelta(days=1)
+                    raise UpstreamUnavailable(upstream, QUOTA, tomorrow.timestamp() - now)
+                if limits["rate_per_minute"]:
+                    if tokens < 1 + token_floor:
+                        raise UpstreamUnavailable(
+                            upstream, RATE, (1 + token_floor - tokens) * 60 / limits["rate_per_minute"]
+                        )
+                    tokens -= 1
+                if failures >= self._failure_threshold:
+                    # 開いていたブレーカーを試しに1回だけ通す（結果が出るまで他の呼び出しは断る）
+                    open_until = now + self._open_seconds
+                self._save(conn, upstream, (tokens, refilled_at, day, used + 1, failures, open_until))
+        except sqlite3.Error as e:
+            print(f"呼び出し回数の制限を確認できませんでした: {upstream}: {str(e)}")
+
+    def record_success(self, upstream: str) -> None:
+        """呼び出しが成功した（ブレーカーを閉じる）"""
+        if upstream not in self._limits:
+            return
+        try:
+            self._connect().execute(
+                "UPDATE upstreams SET failures = 0, open_until = 0 "
+                "WHERE upstream = ? AND (failures > 0 OR open_until > 0)",
+                (upstream,)
+            )
+        except sqlite3.Error as e:
+            print(f"呼び出しの結果を記録できませんでした: {upstream}: {str(e)}")
+
+    def record_failure(self, upstream: str, rate_limited: bool = False, retry_after: Optional[float] = None) -> None:
+        """呼び出しが失敗した（連続した失敗が上限に達するか、取得元に制限されたらブレーカーを開く）
+
+        rate_limited は取得元から回数の制限を告げられた場合（HTTP 429）。retry_after 秒
+        （指定がなければ rate_limited_seconds 秒）ブレーカーを開く
+        """
+        if upstream not in self._limits:
+            return
+
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                tokens, refilled_at, day, used, failures, open_until = self._load(conn, upstream, now)
+                failures += 1
+                if rate_limited:
+                    open_for = retry_after if retry_after is not None else self._rate_limited_seconds
+                    open_until = max(open_until, now + open_for)
+                elif failures >= self._failure_threshold:
+                    open_until = max(open_until, now + self._open_seconds)
+                self._save(conn, upstream, (tokens, refilled_at, day, used, failures, open_until))
+        except sqlite3.Error as e:
+            print(f"呼び出しの結果を記録できませんでした: {upstream}: {str(e)}")
+
+    def states(self) -> Dict[str, Dict]:
+        """取得元ごとの今日の残り回数（上限がなければ None）とブレーカーが開いているか"""
+        now = time.time()
+        conn = self._connect()
+        states = {}
+        for upstream, limits in self._limits.items():
+            _, _, _, used, failures, open_until = self._load(conn, upstream, now)
+            states[upstream] = {
+                "remaining": max(0, int(limits["daily_limit"]) - used) if limits["daily_limit"] else None,
+                "open": open_until > now,
+                "failures": failures
+            }
+        return states
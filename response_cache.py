@@ -0,0 +1,459 @@
+"""外部APIレスポンスの二層キャッシュ
+
+一層目はプロセス内の LRU、二層目はプロセスやレプリカをまたいで共有する
+バックエンド（SQLite または Redis 互換サーバー）。
+有効期限を過ぎた値もしばらく残し、取得に失敗したときの代わりに使う。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from sqlite_local import ThreadLocalConnection
+
+# 有効期限の指定（秒、または値から有効期限を求める関数）
+TTL = Union[float, Callable[[Any], float]]
+
+###################
+# 共有バックエンド
+###################
+
+class CacheBackend(ABC):
+    """共有キャッシュのバックエンド"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """保存されている値を返す（なければ None）"""
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: float) -> None:
+        """値を有効期限付きで保存する"""
+
+class SQLiteBackend(CacheBackend):
+    """SQLite ファイルを使う共有バックエンド（同じホストのプロセス間で共有）"""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._connect = ThreadLocalConnection(path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, size, now + ttl)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """期限切れを削除し、上限サイズを超えた分を期限の近い順に削除する"""
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self._max_bytes:
+            return
+
+        excess = total - self._max_bytes
+        keys = []
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY expires_at"):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM cache WHERE key = ?", keys)
+
+class RedisBackend(CacheBackend):
+    """Redis プロトコルのサーバーを使う共有バックエンド（レプリカ間で共有）"""
+
+    def __init__(self, url: str, prefix: str = "inoki:"):
+        # redis パッケージは Redis バックエンドを使う場合のみ必要
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1.0)
+        self._prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._client.get(self._prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        # サイズによる削除はサーバー側の maxmemory ポリシーに任せる
+        self._client.set(self._prefix + key, value, px=max(1, int(ttl * 1000)))
+
+###################
+# プロセス内 LRU
+###################
+
+class LRUTier:
+    """件数とサイズの上限を持つプロセス内 LRU"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 16 * 1024 * 1024):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """(見つかったか, 値) を返す"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.time():
+                self._remove(key)
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key: str, value: Any, size: int, ttl: float) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self._max_bytes:
+                return
+            self._entries[key] = (time.time() + ttl, value, size)
+            self._bytes += size
+            while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+###################
+# 同時取得のまとめ
+###################
+
+class SingleFlight:
+    """同じキーの同時呼び出しをまとめ、先に来た呼び出しの取得結果を共有する（プロセス内）
+
+    取得中に来た呼び出しは同じ結果を待ち、取得が失敗した場合は同じ例外を受け取る
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, fetch: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """key の取得が進行中ならその結果を待ち、なければ fetch を実行する
+
+        timeout は他の呼び出しの結果を待つ上限（秒）。超えると TimeoutError を送出する
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not is_leader:
+            return future.result(timeout=timeout)
+
+        try:
+            future.set_result(fetch())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+    def in_flight(self) -> int:
+        """進行中の取得の数"""
+        with self._lock:
+            return len(self._calls)
+
+###################
+# 二層キャッシュ
+###################
+
+class ResponseCache:
+    """プロセス内 LRU と共有バックエンドを組み合わせたキャッシュ
+
+    値は JSON にできるものに限る。取得した値は共有されるため変更しないこと。
+    有効期限を過ぎた値は stale_ttl 秒のあいだ残し、get_stale で取り出せる。
+    """
+
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = 600.0,
+        max_entries: int = 256,
+        max_bytes: int = 16 * 1024 * 1024,
+        stale_ttl: float = 24 * 60 * 60
+    ):
+        self._backend = backend
+        self._ttls = ttls or {}
+        self._default_ttl = default_ttl
+        self._stale_ttl = stale_ttl
+        self._memory = LRUTier(max_entries, max_bytes)
+        self._flights = SingleFlight()
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def make_key(source: str, key: Any) -> str:
+        """取得元と引数からキャッシュキーを作る"""
+        raw = json.dumps(key, sort_keys=True, ensure_ascii=False, default=str)
+        return f"{source}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def get(self, source: str, key: Any, count: bool = True) -> Optional[Any]:
+        """有効期限内のキャッシュされた値を返す（なければ None）
+
+        count を False にするとヒット・ミス数に含めない
+        """
+        entry = self._lookup(self.make_key(source, key))
+        if entry is not None and entry[0] > time.time():
+            if count:
+                self._count(source, f"{entry[2]}_hits")
+            return entry[1]
+
+        if count:
+            self._count(source, "misses")
+        return None
+
+    def get_stale(self, source: str, key: Any) -> Optional[Any]:
+        """有効期限を過ぎていても残っている値を返す（なければ None）"""
+        entry = self._lookup(self.make_key(source, key))
+        return entry[1] if entry is not None else None
+
+    def fresh_for(self, source: str, key: Any) -> float:
+        """有効期限までの残り秒数（期限切れかなければ 0）
+
+        他のプロセスが共有層で更新した値も確認する（事前取得で取り直すかどうかの判断用）
+        """
+        cache_key = self.make_key(source, key)
+        found, entry = self._memory.get(cache_key)
+        fresh_until = entry[0] if found else 0.0
+        raw = self._backend_get(cache_key)
+        if raw is not None:
+            fresh_until = max(fresh_until, json.loads(raw)[0])
+        return max(0.0, fresh_until - time.time())
+
+    def set(self, source: str, key: Any, value: Any, ttl: Optional[TTL] = None) -> None:
+        """値を両方の層に保存する"""
+        ttl = self._resolve_ttl(source, value, ttl)
+        if ttl <= 0:
+            return
+
+        cache_key = self.make_key(source, key)
+        fresh_until = time.time() + ttl
+        raw = json.dumps([fresh_until, value], ensure_ascii=False)
+        # 期限切れの値も代わりに使えるよう、しばらく残しておく
+        self._memory.set(cache_key, (fresh_until, value), len(raw), ttl + self._stale_ttl)
+        self._backend_set(cache_key, raw, ttl + self._stale_ttl)
+
+    def get_or_fetch(
+        self,
+        source: str,
+        key: Any,
+        fetch: Callable[[], Any],
+        ttl: Optional[TTL] = None,
+        stale_on_error: bool = True,
+        wait_timeout: Optional[float] = None
+    ) -> Any:
+        """キャッシュになければ fetch で取得して保存する
+
+        同じキーの取得が進行中なら新たに取得せず、wait_timeout 秒までその結果を待つ。
+        取得に失敗した場合は期限切れの値があればそれを返し、なければ例外を送出する
+        """
+        value = self.get(source, key)
+        if value is not None:
+            return value
+
+        cache_key = self.make_key(source, key)
+        led = False
+
+        def fetch_and_set() -> Any:
+            nonlocal led
+            led = True
+            # 直前に終わった取得の結果が保存されていればそれを使う
+            cached = self.get(source, key, count=False)
+            if cached is not None:
+                return cached
+            fetched = fetch()
+            self.set(source, key, fetched, ttl)
+            return fetched
+
+        try:
+            value = self._flights.do(cache_key, fetch_and_set, wait_timeout)
+        except Exception as e:
+            stale = self.get_stale(source, key) if stale_on_error else None
+            if stale is None:
+                raise
+            print(f"取得に失敗したため期限切れのキャッシュを使います: {source}: {str(e)}")
+            self._count(source, "stale_hits")
+            return stale
+        finally:
+            if not led:
+                self._count(source, "coalesced")
+
+        return value
+
+    def refresh(
+        self,
+        source: str,
+        key: Any,
+        fetch: Callable[[], Any],
+        ttl: Optional[TTL] = None
+    ) -> Any:
+        """キャッシュの有無にかかわらず fetch で取得して保存し直す
+
+        同じキーの取得が進行中ならその結果を使う
+        """
+        def fetch_and_set() -> Any:
+            fetched = fetch()
+            self.set(source, key, fetched, ttl)
+            return fetched
+
+        return self._flights.do(self.make_key(source, key), fetch_and_set)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """取得元ごとのヒット・ミス数（coalesced は進行中の取得の結果を待って使った数）"""
+        with self._stats_lock:
+            return {source: dict(counts) for source, counts in self._stats.items()}
+
+    def in_flight(self) -> int:
+        """進行中の取得の数（同じキーの呼び出しは1件と数える）"""
+        return self._flights.in_flight()
+
+    def _resolve_ttl(self, source: str, value: Any, ttl: Optional[TTL]) -> float:
+        if ttl is None:
+            return self._ttls.get(source, self._default_ttl)
+        if callable(ttl):
+            return ttl(value)
+        return ttl
+
+    def _count(self, source: str, name: str) -> None:
+        with self._stats_lock:
+            counts = self._stats.setdefault(
+                source, {"memory_hits": 0, "shared_hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0}
+            )
+            counts[name] += 1
+
+    def _lookup(self, cache_key: str) -> Optional[Tuple[float, Any, str]]:
+        """(有効期限, 値, 見つかった層) を返す。期限切れの値も含む"""
+        found, entry = self._memory.get(cache_key)
+        if found and entry[0] > time.time():
+            return entry[0], entry[1], "memory"
+
+        # 手元の値が期限切れなら、他のプロセスが更新していないか共有層も確認する
+        raw = self._backend_get(cache_key)
+        if raw is not None:
+            fresh_until, value = json.loads(raw)
+            if not found or fresh_until > entry[0]:
+                hard_ttl = fresh_until + self._stale_ttl - time.time()
+                if hard_ttl > 0:
+                    self._memory.set(cache_key, (fresh_until, value), len(raw), hard_ttl)
+                return fresh_until, value, "shared"
+
+        return (entry[0], entry[1], "memory") if found else None
+
+    def _backend_get(self, cache_key: str) -> Optional[str]:
+        if self._backend is None:
+            return None
+        try:
+            return self._backend.get(cache_key)
+        except Exception as e:
+            # 共有キャッシュの障害ではリクエストを失敗させない
+            print(f"共有キャッシュの読み込みに失敗しました: {str(e)}")
+            return None
+
+    def _backend_set(self, cache_key: str, raw: str, ttl: float) -> None:
+        if self._backend is None:
+            return
+        try:
+            self._backend.set(cache_key, raw, ttl)
+        except Exception as e:
+            print(f"共有キャッシュへの書き込みに失敗しました: {str(e)}")
+
+###################
+# 生成結果のプール
+###################
+
+class VariantPool:
+    """同じ入力に対する生成結果を複数保持し、順番に返すプール
+
+    プールは二層キャッシュに保存する。二度目以降の要求があったキーだけ
+    バックグラウンドで1件ずつ追加するため、一度きりの入力で余分に生成しない。
+    """
+
+    def __init__(self, cache: ResponseCache, source: str, size: int, max_workers: int = 2):
+        self._cache = cache
+        self._source = source
+        self._size = size
+        self._lock = threading.Lock()
+        self._served: "OrderedDict[str, int]" = OrderedDict()
+        self._filling: Set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="variant-pool")
+
+    def next(self, key: Any) -> Optional[str]:
+        """保持している結果を順番に返す（なければ None）"""
+        variants = self._cache.get(self._source, key)
+        if not variants:
+            return None
+
+        cache_key = ResponseCache.make_key(self._source, key)
+        with self._lock:
+            index = self._served.pop(cache_key, 0)
+            self._served[cache_key] = index + 1
+            # 返した回数はよく使うキーだけ覚えておく
+            while len(self._served) > 1024:
+                self._served.popitem(last=False)
+        return variants[index % len(variants)]
+
+    def add(self, key: Any, variant: str) -> None:
+        """結果をプールに追加する（上限に達していれば何もしない）"""
+        with self._lock:
+            variants: List[str] = list(self._cache.get(self._source, key, count=False) or [])
+            if len(variants) < self._size and variant not in variants:
+                variants.append(variant)
+                self._cache.set(self._source, key, variants)
+
+    def fill_async(self, key: Any, generate: Callable[[], str]) -> None:
+        """プールが埋まっていなければバックグラウンドで1件生成して追加する"""
+        cache_key = ResponseCache.make_key(self._source, key)
+        with self._lock:
+            if cache_key in self._filling:
+                return
+            self._filling.add(cache_key)
+
+        def fill() -> None:
+            try:
+                variants = self._cache.get(self._source, key, count=False) or []
+                if len(variants) < self._size:
+                    self.add(key, generate())
+            except Exception as e:
+                print(f"生成結果の追加に失敗しました: {str(e)}")
+            finally:
+                with self._lock:
+                    self._filling.discard(cache_key)
+
+        self._executor.submit(fill)
@@ -0,0 +1,36 @@
+"""SQLite ファイルへのスレッドごとの接続
+
+sqlite3 の接続は作ったスレッドでしか使えないため、スレッドごとに1つ接続を作って使い回す。
+"""
+import sqlite3
+import threading
+from typing import Optional, Sequence
+
+class ThreadLocalConnection:
+    """呼び出すと、呼び出したスレッドの接続を返す（なければ作る）
+
+    isolation_level は sqlite3.connect と同じ（None で自動コミット）。
+    pragmas は接続ごとに設定する PRAGMA（"synchronous=NORMAL" など）
+    """
+
+    def __init__(
+        self,
+        path: str,
+        timeout: float = 5.0,
+        isolation_level: Optional[str] = "",
+        pragmas: Sequence[str] = ()
+    ):
+        self._path = path
+        self._timeout = timeout
+        self._isolation_level = isolation_level
+        self._pragmas = tuple(pragmas)
+        self._local = threading.local()
+
+    def __call__(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=self._isolation_level)
+            for pragma in self._pragmas:
+                conn.execute(f"PRAGMA {pragma}")
+            self._local.conn = conn
+        return conn
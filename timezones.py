@@ -0,0 +1,5 @@
+"""モジュール間で共有するタイムゾーン"""
+from datetime import timedelta, timezone
+
+# 日本標準時（1日の回数の区切りや天気予報の発表時刻はこの時刻で扱う）
+JST = timezone(timedelta(hours=9))
@@ -0,0 +1,89 @@
+"""プロンプトのトークン数の見積もりと使用量の記録"""
+import math
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+@lru_cache(maxsize=4)
+def _encoding(model: str):
+    """tiktoken のエンコーディング（インストールされていなければ None）"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str, model: str) -> int:
+    """文字列のトークン数
+
+    tiktoken がない場合は、日本語など ASCII 以外の文字を1文字あたり約1.2トークン、
+    ASCII を4文字あたり1トークンとして多めに見積もる
+    """
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return math.ceil((len(text) - ascii_chars) * 1.2 + ascii_chars / 4)
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """長い文字列を末尾を省略して切り詰める"""
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+def fit_to_budget(groups: List[List[str]], budget: int, model: str) -> List[List[str]]:
+    """各グループの行を、合計トークン数が予算に収まるまで後ろから1行ずつ減らす
+
+    グループ間では行数の多いグループから順に減らす
+    """
+    groups = [list(lines) for lines in groups]
+    while sum(count_tokens("\n".join(lines), model) for lines in groups) > budget:
+        largest = max(groups, key=len)
+        if not largest:
+            break
+        largest.pop()
+    return groups
+
+class UsageLedger:
+    """リクエストごとのトークン使用量の記録"""
+
+    def __init__(self, max_records: int = 1000):
+        self._lock = threading.Lock()
+        self._records: deque = deque(maxlen=max_records)
+        self._totals = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def record(
+        self,
+        model: str,
+        prompt_tokens: Optional[int],
+        completion_tokens: Optional[int],
+        estimated_prompt_tokens: int,
+        max_tokens: int
+    ) -> None:
+        """1回分の使用量を記録する（API が使用量を返さなかった場合は None）"""
+        with self._lock:
+            self._records.append({
+                "time": time.time(),
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "estimated_prompt_tokens": estimated_prompt_tokens,
+                "max_tokens": max_tokens
+            })
+            self._totals["requests"] += 1
+            self._totals["prompt_tokens"] += prompt_tokens or 0
+            self._totals["completion_tokens"] += completion_tokens or 0
+
+    def totals(self) -> Dict[str, int]:
+        """これまでの合計"""
+        with self._lock:
+            return dict(self._totals)
+
+    def records(self) -> List[Dict]:
+        """直近の記録"""
+        with self._lock:
+            return list(self._records)